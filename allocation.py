@@ -0,0 +1,278 @@
+"""Slot allocation policies used by park_car.
+
+A policy turns a lot layout (the list of ``(floor_id, row_id, slot_id)`` keys)
+into a fixed preference ordering. The ordering is computed once per layout;
+picking a slot afterwards is a heap pop over the ranks of the free slots, so
+no ORDER BY is needed on the slots table for each car.
+"""
+import heapq
+import threading
+import time
+from collections import defaultdict
+
+VEHICLE_TYPES = ('car', 'two_wheeler')
+DEFAULT_POLICY = 'fill_floor_first'
+
+# Cost weights used by nearest_gate: changing floor (a ramp) costs more than
+# moving to another row, which costs more than moving along a row.
+FLOOR_COST = 50
+ROW_COST = 5
+
+
+def _ranks(keys):
+    """Map each distinct value to its position in sorted order."""
+    return {value: rank for rank, value in enumerate(sorted(set(keys)))}
+
+
+def fill_floor_first(layout, **options):
+    """Lowest floor, then row, then slot - the original park_car behaviour."""
+    return sorted(layout)
+
+
+def spread_floors(layout, **options):
+    """Round-robin across floors so every floor fills at the same rate."""
+    by_floor = defaultdict(list)
+    for key in sorted(layout):
+        by_floor[key[0]].append(key)
+    floors = [by_floor[floor_id] for floor_id in sorted(by_floor)]
+    ordering = []
+    for position in range(max((len(f) for f in floors), default=0)):
+        for floor_slots in floors:
+            if position < len(floor_slots):
+                ordering.append(floor_slots[position])
+    return ordering
+
+
+def nearest_gate(layout, gate_floor_id=None, **options):
+    """Closest slots to the entry/exit gate first.
+
+    The gate sits at the start of the first row of ``gate_floor_id`` (the
+    lowest floor by default). Distance is a weighted sum of floors, rows and
+    slots travelled, so an empty upper floor near the ramp can beat the far
+    end of a long ground floor.
+    """
+    floor_ranks = _ranks(key[0] for key in layout)
+    row_ranks = defaultdict(dict)
+    slot_ranks = defaultdict(dict)
+    for floor_id, row_id, slot_id in sorted(layout):
+        rows = row_ranks[floor_id]
+        rows.setdefault(row_id, len(rows))
+        slots = slot_ranks[(floor_id, row_id)]
+        slots.setdefault(slot_id, len(slots))
+
+    gate_rank = floor_ranks.get(gate_floor_id, 0)
+
+    def distance(key):
+        floor_id, row_id, slot_id = key
+        return (
+            abs(floor_ranks[floor_id] - gate_rank) * FLOOR_COST
+            + row_ranks[floor_id][row_id] * ROW_COST
+            + slot_ranks[(floor_id, row_id)][slot_id],
+            key
+        )
+
+    return sorted(layout, key=distance)
+
+
+def two_wheeler_reserved(layout, vehicle_type='car', reserved_rows=(), **options):
+    """Keep ``reserved_rows`` for two-wheelers.
+
+    Cars only ever get slots outside the reserved rows. Two-wheelers get the
+    reserved rows first and overflow into the car area once those are full.
+    """
+    reserved_rows = {tuple(r) for r in reserved_rows}
+    reserved = [key for key in sorted(layout) if key[:2] in reserved_rows]
+    general = [key for key in sorted(layout) if key[:2] not in reserved_rows]
+    if vehicle_type == 'two_wheeler':
+        return reserved + general
+    return general
+
+
+POLICIES = {
+    'fill_floor_first': fill_floor_first,
+    'spread_floors': spread_floors,
+    'nearest_gate': nearest_gate,
+    'two_wheeler_reserved': two_wheeler_reserved,
+}
+
+
+def build_ordering(policy, layout, vehicle_type='car', **options):
+    if policy not in POLICIES:
+        raise ValueError(f'Unknown allocation policy: {policy}')
+    return POLICIES[policy](layout, vehicle_type=vehicle_type, **options)
+
+
+def build_ranks(policy, layout, **options):
+    """``{vehicle_type: {key: rank}}`` of a policy's orderings for a layout."""
+    ranks = {}
+    for vehicle_type in VEHICLE_TYPES:
+        ordering = build_ordering(policy, layout, vehicle_type=vehicle_type, **options)
+        ranks[vehicle_type] = {key: rank for rank, key in enumerate(ordering)}
+    return ranks
+
+
+class LotAllocator:
+    """Precomputed orderings plus a free-slot heap per vehicle type for one lot.
+
+    ``ranks`` from ``build_ranks`` can be passed in to reuse the orderings of
+    an unchanged layout.
+    """
+
+    def __init__(self, layout, free_slots, policy=DEFAULT_POLICY, ranks=None, **options):
+        self.policy = policy
+        self.layout = frozenset(layout)
+        self.free = set(free_slots) & self.layout
+        self.ranks = ranks if ranks is not None else build_ranks(policy, layout, **options)
+        self.heaps = {}
+        for vehicle_type, ranks in self.ranks.items():
+            heap = [(ranks[key], key) for key in self.free if key in ranks]
+            heapq.heapify(heap)
+            self.heaps[vehicle_type] = heap
+
+    def pop(self, vehicle_type='car'):
+        """Take the best free slot for ``vehicle_type``, or None if full."""
+        heap = self.heaps[vehicle_type]
+        while heap:
+            _, key = heapq.heappop(heap)
+            if key in self.free:
+                self.free.discard(key)
+                return key
+        return None
+
+    def occupy(self, key):
+        # Stale heap entries are skipped lazily by pop()
+        self.free.discard(key)
+
+    def release(self, key):
+        if key not in self.layout or key in self.free:
+            return
+        self.free.add(key)
+        for vehicle_type, ranks in self.ranks.items():
+            if key in ranks:
+                heapq.heappush(self.heaps[vehicle_type], (ranks[key], key))
+
+
+class SlotAllocator:
+    """Per-app registry of LotAllocators, built lazily from the database.
+
+    ``layout_loader(lot_id)`` returns every slot key of a lot and
+    ``free_loader(lot_id)`` the free ones; ``options_for(lot_id)`` returns the
+    policy name and its keyword options for that lot.
+
+    Allocators older than ``max_age`` seconds are rebuilt from a fresh free
+    list so slots freed by other workers rejoin the ordering. The layout is
+    only read again after ``invalidate`` or when a free slot is missing from
+    it, and orderings are cached per (layout, policy, options), so a reload
+    is one free-slot query and a heapify. ``pop(reload=True)`` (the lot looks
+    full) reloads at most once per ``min_reload`` seconds.
+
+    Loading runs outside the registry lock: other lots keep allocating, the
+    lot being reloaded keeps using its old allocator if it has one, and
+    changes made meanwhile are replayed on the new allocator.
+    """
+
+    def __init__(self, layout_loader, free_loader, options_for, max_age=30, min_reload=1.0):
+        self.layout_loader = layout_loader
+        self.free_loader = free_loader
+        self.options_for = options_for
+        self.max_age = max_age
+        self.min_reload = min_reload
+        self.lots = {}
+        self.built_at = {}
+        self.layouts = {}     # lot_id -> frozenset of slot keys
+        self.orderings = {}   # (layout, policy, options) -> build_ranks() result
+        self.pending = {}     # lot_id -> [(method, key), ...] while a load is in flight
+        self.load_locks = {}
+        self.lock = threading.Lock()
+
+    def _record(self, lot_id, method, key):
+        # Caller holds self.lock
+        if lot_id in self.lots:
+            getattr(self.lots[lot_id], method)(key)
+        if lot_id in self.pending:
+            self.pending[lot_id].append((method, key))
+
+    def _usable(self, lot_id, reload):
+        # Caller holds self.lock
+        if lot_id not in self.lots:
+            return False
+        if lot_id in self.pending:
+            return True
+        age = time.monotonic() - self.built_at[lot_id]
+        return age < self.min_reload if reload else age <= self.max_age
+
+    def _ranks(self, layout, policy, options):
+        cache_key = (layout, policy, repr(sorted(options.items())))
+        with self.lock:
+            ranks = self.orderings.get(cache_key)
+        if ranks is None:
+            ranks = build_ranks(policy, layout, **options)
+            with self.lock:
+                self.orderings[cache_key] = ranks
+        return ranks
+
+    def _load(self, lot_id):
+        requested = time.monotonic()
+        with self.lock:
+            load_lock = self.load_locks.setdefault(lot_id, threading.Lock())
+        with load_lock:
+            with self.lock:
+                if self.built_at.get(lot_id, -1) >= requested:
+                    return  # another thread loaded it while we waited
+                self.pending[lot_id] = []
+            try:
+                free_slots = self.free_loader(lot_id)
+                with self.lock:
+                    layout = self.layouts.get(lot_id)
+                if layout is None or not layout.issuperset(free_slots):
+                    layout = frozenset(self.layout_loader(lot_id))
+                policy, options = self.options_for(lot_id)
+                allocator = LotAllocator(layout, free_slots, policy, ranks=self._ranks(layout, policy, options))
+            except Exception:
+                with self.lock:
+                    del self.pending[lot_id]
+                raise
+            with self.lock:
+                for method, key in self.pending.pop(lot_id):
+                    getattr(allocator, method)(key)
+                self.lots[lot_id] = allocator
+                self.layouts[lot_id] = layout
+                self.built_at[lot_id] = time.monotonic()
+
+    def pop(self, lot_id, vehicle_type='car', reload=False):
+        while True:
+            with self.lock:
+                usable = self._usable(lot_id, reload)
+            if not usable:
+                self._load(lot_id)
+            with self.lock:
+                if lot_id not in self.lots:
+                    continue  # invalidated while loading
+                key = self.lots[lot_id].pop(vehicle_type)
+                if key is not None and lot_id in self.pending:
+                    self.pending[lot_id].append(('occupy', key))
+                return key
+
+    def occupy(self, lot_id, key):
+        with self.lock:
+            self._record(lot_id, 'occupy', key)
+
+    def release(self, lot_id, key):
+        with self.lock:
+            self._record(lot_id, 'release', key)
+
+    def invalidate(self, lot_id=None):
+        """Drop cached orderings, e.g. after floors/rows/slots are added."""
+        with self.lock:
+            if lot_id is None:
+                self.lots.clear()
+                self.built_at.clear()
+                self.layouts.clear()
+                self.orderings.clear()
+            else:
+                self.lots.pop(lot_id, None)
+                self.built_at.pop(lot_id, None)
+                layout = self.layouts.pop(lot_id, None)
+                if layout not in self.layouts.values():
+                    for cache_key in [k for k in self.orderings if k[0] == layout]:
+                        del self.orderings[cache_key]
@@ -1,14 +1,27 @@
 import os
 import urllib.parse
+import click
+import heapq
 from datetime import datetime, timedelta
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.exc import IntegrityError
-from sqlalchemy import Column, Integer, String, ForeignKeyConstraint, text, Computed
+from sqlalchemy.exc import IntegrityError, OperationalError, InterfaceError
+from sqlalchemy import Column, Integer, String, ForeignKeyConstraint, Index, text, Computed, func, case, tuple_, update
+from sqlalchemy import BigInteger, Float, cast, extract, literal_column, select, union_all
 from sqlalchemy.orm import relationship
 import jwt
+import numpy as np
 from functools import wraps
+from itertools import chain
 from dotenv import load_dotenv
+from allocation import SlotAllocator, VEHICLE_TYPES, DEFAULT_POLICY
+from caches import PlateCache, StructureCache
+from billing import parse_tariff, bill_sessions, UNAVAILABLE
+from query_budget import init_query_budget, query_budget
+from forecast import ForecastModel, HOURS_PER_WEEK
+from slot_status import StatusBoard, layout_version
+from event_log import EventLog, EventLogCorrupt, EventLogFailed, EventLogLocked, EventWriter, unavailable
+from sharding import LotRouter, LotShardSession, on_shard, add_lot_tables
 
 # Load environment variables from .env file if it exists (useful for local dev)
 load_dotenv()
@@ -16,8 +29,17 @@ load_dotenv()
 # Simple JWT configuration
 JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'your-secret-key-here')  # Change in production!
 JWT_EXPIRATION_HOURS = 24
-# Initialize SQLAlchemy
-db = SQLAlchemy()
+
+def normalize_reg_no(reg_no):
+    """Canonical plate form used for lookups: upper case, no spaces or hyphens"""
+    return reg_no.upper().replace(' ', '').replace('-', '')
+
+def plate_key(column):
+    """SQL mirror of normalize_reg_no, used by the plate indexes"""
+    return func.upper(func.replace(func.replace(column, ' ', ''), '-', ''))
+
+# Initialize SQLAlchemy; lot tables are routed to the lot's shard, see sharding.py
+db = SQLAlchemy(session_options={'class_': LotShardSession})
 
 # MODELS
 class ParkingLotDetails(db.Model):
@@ -81,7 +103,7 @@ class Row(db.Model):
     floor = relationship(
         'Floor',
         back_populates='rows',
-        lazy='joined'
+        lazy='select'
     )
 
     slots = relationship(
@@ -112,7 +134,7 @@ class Slot(db.Model):
     row = relationship(
         'Row',
         back_populates='slots',
-        lazy='joined'
+        lazy='select'
     )
 
 class ParkingSession(db.Model):
@@ -124,8 +146,12 @@ class ParkingSession(db.Model):
     slot_id = db.Column(db.Integer)
     vehicle_reg_no = db.Column(db.String(20), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'))
+    vehicle_type = db.Column(db.String(20), default='car')
+    fee = db.Column(db.Numeric(10, 2))
     start_time = db.Column(db.DateTime)
     end_time = db.Column(db.DateTime)
+    # Closed by the stale-session sweep: end_time is the sweep time, not an exit
+    swept = db.Column(db.Boolean, nullable=False, default=False, server_default=text('false'))
     duration_hrs = db.Column(
         db.Numeric,
         Computed(
@@ -143,6 +169,34 @@ class ParkingSession(db.Model):
         ),
     )
 
+# Find-my-car index: normalized plate of open sessions only
+Index(
+    'ix_parking_sessions_open_plate_key',
+    plate_key(ParkingSession.vehicle_reg_no),
+    postgresql_where=ParkingSession.end_time.is_(None)
+)
+# Stale-session sweep: oldest open sessions per lot
+Index(
+    'ix_parking_sessions_open_start',
+    ParkingSession.parkinglot_id,
+    ParkingSession.start_time,
+    postgresql_where=ParkingSession.end_time.is_(None)
+)
+
+# Tables keyed by parkinglot_id live on the lot's shard
+LOT_TABLES = [
+    ParkingLotDetails.__table__, Floor.__table__, Row.__table__, Slot.__table__, ParkingSession.__table__
+]
+for table in LOT_TABLES:
+    table.info['lot_shard'] = True
+
+def ticket_lot_id(ticket_id):
+    """Lot id embedded in TKT-{lot}-{floor}-{row}-{slot}-{ms} tickets, or None for older formats"""
+    parts = ticket_id.split('-')
+    if len(parts) == 6 and parts[1].isdigit():
+        return int(parts[1])
+    return None
+
 class User(db.Model):
     __tablename__ = 'users'
     user_id = db.Column(db.Integer, primary_key=True)
@@ -168,7 +222,485 @@ def create_app(test_config=None):
         app.config['SQLALCHEMY_DATABASE_URI'] = f"postgresql://{username}:{password}@{host}:{port}/{database_name}"
         app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+    # Slot allocation: a default policy plus per-lot overrides keyed by parkinglot_id
+    app.config.setdefault('SLOT_ALLOCATION_POLICY', DEFAULT_POLICY)
+    app.config.setdefault('SLOT_ALLOCATION_POLICIES', {})
+    app.config.setdefault('TWO_WHEELER_ROWS', {})  # {lot_id: [(floor_id, row_id), ...]}
+    app.config.setdefault('GATE_FLOORS', {})  # {lot_id: floor_id}
+    app.config.setdefault('SLOT_ALLOCATOR_MAX_AGE', 30)  # seconds before free lists are reloaded
+    app.config.setdefault('SLOT_ALLOCATOR_MIN_RELOAD', 1)  # seconds between free-list reloads of a full lot
+    app.config.setdefault('VEHICLE_CACHE_SIZE', 10000)
+    app.config.setdefault('VEHICLE_CACHE_TTL', 30)  # seconds
+    app.config.setdefault('STRUCTURE_CACHE_MAX_BYTES', 64 * 1024 * 1024)
+    app.config.setdefault('STRUCTURE_CACHE_TTL', 5)  # seconds
+    app.config.setdefault('LAYOUT_MAX_AGE', 24 * 3600)  # seconds clients may cache /layout
+    app.config.setdefault('FORECAST_UTC_OFFSET_HOURS', 0)  # local time of the lots' traffic pattern
+    app.config.setdefault('FORECAST_PROFILE_MAX_AGE', 900)  # seconds before a lot's profile is rebuilt
+    app.config.setdefault('STALE_SESSION_HOURS', 24)
+    app.config.setdefault('STALE_SESSION_HOURS_BY_LOT', {})  # {lot_id: hours}
+    app.config.setdefault('SWEEP_CHUNK_SIZE', 500)
+    app.config.setdefault('ADMIN_USER_IDS', [])
+    app.config.setdefault('EVENT_LOG_DIR', None)  # set to acknowledge gates from a local write-ahead log
+    app.config.setdefault('EVENT_LOG_SEGMENT_BYTES', 64 * 1024 * 1024)
+    app.config.setdefault('EVENT_LOG_FSYNC', True)
+    app.config.setdefault('EVENT_WRITER_BATCH_SIZE', 500)
+    app.config.setdefault('EVENT_LOG_SUBMIT_TIMEOUT', 5)  # seconds a gate waits for its fsync before a 503
+    app.config.setdefault('LOT_SHARDS', [])  # [(first_lot_id, bind_key), ...]; None is the default database
+    app.config.setdefault('QUERY_BUDGET_DEBUG', os.environ.get('QUERY_BUDGET_DEBUG') == '1')
+
     db.init_app(app)
+    init_query_budget(app)
+
+    # Lot sharding: lot-scoped code picks the lot's shard, listings scatter to all
+    lot_router = LotRouter(app.config['LOT_SHARDS'])
+    app.extensions['lot_router'] = lot_router
+
+    def lot_shard(lot_id):
+        return on_shard(lot_router.shard_for(lot_id))
+
+    def route_lot(lot_id):
+        """Send the rest of this request's lot queries to the lot's shard"""
+        g.lot_shard = lot_router.shard_for(lot_id)
+
+    def lot_scoped(f):
+        @wraps(f)
+        def decorated(lot_id, *args, **kwargs):
+            with lot_shard(lot_id):
+                return f(lot_id, *args, **kwargs)
+        return decorated
+
+    def scatter(query):
+        """Concatenate query() run against every shard"""
+        results = []
+        for bind_key in lot_router.shards():
+            with on_shard(bind_key):
+                results.extend(query())
+        return results
+
+    def scatter_first(query):
+        """First non-None query() result across shards, routing the request to its shard"""
+        for bind_key in lot_router.shards():
+            with on_shard(bind_key):
+                result = query()
+            if result is not None:
+                g.lot_shard = bind_key
+                return result
+        return None
+
+    # Slot allocation helpers
+    @lot_scoped
+    def load_lot_layout(lot_id):
+        return [tuple(s) for s in db.session.query(
+            Slot.floor_id, Slot.row_id, Slot.slot_id
+        ).filter_by(parkinglot_id=lot_id)]
+
+    @lot_scoped
+    def load_free_slots(lot_id):
+        return [tuple(s) for s in db.session.query(
+            Slot.floor_id, Slot.row_id, Slot.slot_id
+        ).filter_by(parkinglot_id=lot_id, status=0)]
+
+    def allocation_options(lot_id):
+        policy = app.config['SLOT_ALLOCATION_POLICIES'].get(
+            lot_id, app.config['SLOT_ALLOCATION_POLICY']
+        )
+        return policy, {
+            'reserved_rows': app.config['TWO_WHEELER_ROWS'].get(lot_id, ()),
+            'gate_floor_id': app.config['GATE_FLOORS'].get(lot_id)
+        }
+
+    slot_allocator = SlotAllocator(
+        load_lot_layout, load_free_slots, allocation_options,
+        max_age=app.config['SLOT_ALLOCATOR_MAX_AGE'],
+        min_reload=app.config['SLOT_ALLOCATOR_MIN_RELOAD']
+    )
+    app.extensions['slot_allocator'] = slot_allocator
+
+    def allocate_slot(lot_id, vehicle_type):
+        # The in-memory free list can lag behind other workers, so every
+        # candidate is checked against the database and the list is rebuilt
+        # once if it runs dry.
+        for reload in (False, True):
+            key = slot_allocator.pop(lot_id, vehicle_type, reload=reload)
+            while key is not None:
+                slot = db.session.get(Slot, (lot_id, *key))
+                if slot is not None and slot_is_free(slot):
+                    return slot
+                key = slot_allocator.pop(lot_id, vehicle_type)
+        return None
+
+    def slot_is_free(slot):
+        # Logged events not yet applied are newer than the database row
+        if event_writer is not None:
+            logged, ticket_id = event_writer.pending.slot(
+                slot.parkinglot_id, (slot.floor_id, slot.row_id, slot.slot_id)
+            )
+            if logged:
+                return ticket_id is None
+        return slot.status == 0
+
+    # Find-my-car helpers
+    vehicle_cache = PlateCache(app.config['VEHICLE_CACHE_SIZE'], app.config['VEHICLE_CACHE_TTL'])
+    app.extensions['vehicle_cache'] = vehicle_cache
+
+    def find_open_session(plate):
+        return ParkingSession.query.filter(
+            plate_key(ParkingSession.vehicle_reg_no) == plate,
+            ParkingSession.end_time.is_(None)
+        ).order_by(ParkingSession.start_time.desc()).first()
+
+    # Parking lot structure cache
+    def load_lots_structure(lot_ids):
+        # Three flat column queries per shard for all the lots instead of
+        # walking Floor.rows/Row.slots, which lazy-load one query per floor
+        # and per row
+        by_shard = {}
+        for lot_id in lot_ids:
+            by_shard.setdefault(lot_router.shard_for(lot_id), []).append(lot_id)
+        result = {lot_id: [] for lot_id in lot_ids}
+        for bind_key, shard_lot_ids in by_shard.items():
+            with on_shard(bind_key):
+                floors = db.session.query(Floor.parkinglot_id, Floor.floor_id, Floor.floor_name).filter(
+                    Floor.parkinglot_id.in_(shard_lot_ids)
+                ).order_by(Floor.parkinglot_id, Floor.floor_id).all()
+                rows = db.session.query(Row.parkinglot_id, Row.floor_id, Row.row_id, Row.row_name).filter(
+                    Row.parkinglot_id.in_(shard_lot_ids)
+                ).order_by(Row.parkinglot_id, Row.floor_id, Row.row_id).all()
+                slots = db.session.query(
+                    Slot.parkinglot_id, Slot.floor_id, Slot.row_id, Slot.slot_id, Slot.slot_name,
+                    Slot.status, Slot.vehicle_reg_no, Slot.ticket_id
+                ).filter(Slot.parkinglot_id.in_(shard_lot_ids)).order_by(
+                    Slot.parkinglot_id, Slot.floor_id, Slot.row_id, Slot.slot_id
+                ).all()
+
+            floor_rows = {}
+            for floor in floors:
+                floor_data = {'floor_id': floor.floor_id, 'floor_name': floor.floor_name, 'rows': []}
+                floor_rows[(floor.parkinglot_id, floor.floor_id)] = floor_data['rows']
+                result[floor.parkinglot_id].append(floor_data)
+            row_slots = {}
+            for row in rows:
+                row_data = {'row_id': row.row_id, 'row_name': row.row_name, 'slots': []}
+                row_slots[(row.parkinglot_id, row.floor_id, row.row_id)] = row_data['slots']
+                floor_rows[(row.parkinglot_id, row.floor_id)].append(row_data)
+            for slot in slots:
+                row_slots[(slot.parkinglot_id, slot.floor_id, slot.row_id)].append({
+                    'slot_id': slot.slot_id,
+                    'slot_name': slot.slot_name,
+                    'status': slot.status,
+                    'vehicle_reg_no': slot.vehicle_reg_no,
+                    'ticket_id': slot.ticket_id
+                })
+        return result
+
+    structure_cache = StructureCache(
+        load_lots_structure,
+        max_bytes=app.config['STRUCTURE_CACHE_MAX_BYTES'],
+        ttl=app.config['STRUCTURE_CACHE_TTL']
+    )
+    app.extensions['structure_cache'] = structure_cache
+
+    # Bitset slot status for display boards
+    @lot_scoped
+    def load_lot_status(lot_id):
+        return db.session.query(Slot.floor_id, Slot.row_id, Slot.slot_id, Slot.status).filter_by(
+            parkinglot_id=lot_id
+        ).order_by(Slot.floor_id, Slot.row_id, Slot.slot_id).all()
+
+    status_board = StatusBoard(load_lot_status, ttl=app.config['STRUCTURE_CACHE_TTL'])
+    app.extensions['status_board'] = status_board
+
+    def slot_changed(lot_id, key, vehicle_reg_no=None, ticket_id=None):
+        """Bring the in-memory slot views in line after a committed park/unpark"""
+        occupied = ticket_id is not None
+        structure_cache.update_slot(
+            lot_id, key, status=int(occupied), vehicle_reg_no=vehicle_reg_no, ticket_id=ticket_id
+        )
+        status_board.set(lot_id, key, occupied)
+        if not occupied:
+            slot_allocator.release(lot_id, key)
+
+    # Billing helpers: charge strings are parsed once per lot, and again
+    # only when the lot's charges change
+    tariff_book = {}
+    app.extensions['tariff_book'] = tariff_book
+
+    def tariffs_for(parking_lot):
+        """Return [car tariff, two-wheeler tariff] for a lot, in VEHICLE_TYPES order"""
+        charges = (parking_lot.car_parking_charge, parking_lot.two_wheeler_parking_charge)
+        parsed, tariffs = tariff_book.get(parking_lot.parkinglot_id, (None, None))
+        if parsed != charges:
+            tariffs = []
+            for charge in charges:
+                try:
+                    tariffs.append(parse_tariff(charge))
+                except ValueError as e:
+                    app.logger.warning('Lot %s: %s', parking_lot.parkinglot_id, e)
+                    tariffs.append(None)
+            tariff_book[parking_lot.parkinglot_id] = (charges, tariffs)
+        return tariffs
+
+    def session_fee(session, end_time):
+        parking_lot = db.session.get(ParkingLotDetails, session.parkinglot_id)
+        if not parking_lot:
+            return None
+        vehicle_type = session.vehicle_type or 'car'
+        tariff = tariffs_for(parking_lot)[VEHICLE_TYPES.index(vehicle_type)]
+        if tariff is None:
+            return None
+        hours = round((end_time - session.start_time).total_seconds() / 3600.0, 1)
+        return tariff.fee(hours)
+
+    # Occupancy forecasting: hour-of-week profiles built from closed sessions
+    @lot_scoped
+    def load_session_history(lot_id, offset):
+        # Counted per hour of week in SQL, so a cold lot is 336 rows at most
+        # rather than every closed session; 1970-01-01 was a Thursday
+        shift = int(offset.total_seconds()) + 3 * 24 * 3600
+
+        def counts(kind, column):
+            hour = (cast(extract('epoch', column), BigInteger) + shift) // 3600 % HOURS_PER_WEEK
+            return select(
+                literal_column(f"'{kind}'").label('kind'), hour.label('hour_of_week'), func.count().label('sessions'),
+                func.min(ParkingSession.start_time).label('first_seen'),
+                func.max(ParkingSession.end_time).label('last_seen')
+            ).where(
+                ParkingSession.parkinglot_id == lot_id,
+                ParkingSession.start_time.isnot(None),
+                ParkingSession.end_time.isnot(None),
+                ParkingSession.swept.is_(False)
+            ).group_by(literal_column('hour_of_week'))
+
+        rows = db.session.execute(union_all(
+            counts('arrivals', ParkingSession.start_time), counts('departures', ParkingSession.end_time)
+        )).all()
+        history = {'arrivals': {}, 'departures': {}}
+        for row in rows:
+            history[row.kind][int(row.hour_of_week)] = row.sessions
+        return (
+            history['arrivals'], history['departures'],
+            min((row.first_seen for row in rows), default=None),
+            max((row.last_seen for row in rows), default=None)
+        )
+
+    forecast_model = ForecastModel(
+        load_session_history, app.config['FORECAST_UTC_OFFSET_HOURS'],
+        max_age=app.config['FORECAST_PROFILE_MAX_AGE']
+    )
+    app.extensions['forecast_model'] = forecast_model
+
+    # Write-ahead event log: gates are acknowledged once their event is on
+    # local disk, and a background writer applies events in group commits
+    def apply_gate_event(event):
+        key = {
+            'parkinglot_id': event['parkinglot_id'],
+            'floor_id': event['floor_id'],
+            'row_id': event['row_id'],
+            'slot_id': event['slot_id']
+        }
+        session = db.session.get(ParkingSession, event['ticket_id'])
+        if event['type'] == 'park':
+            if session is None:
+                db.session.add(ParkingSession(
+                    ticket_id=event['ticket_id'],
+                    vehicle_reg_no=event['vehicle_reg_no'],
+                    user_id=event['user_id'],
+                    vehicle_type=event['vehicle_type'],
+                    start_time=datetime.fromisoformat(event['start_time']),
+                    **key
+                ))
+            elif session.end_time is not None:
+                return  # replayed after its unpark was applied
+            db.session.execute(
+                update(Slot).filter_by(**key).values(
+                    status=1, vehicle_reg_no=event['vehicle_reg_no'], ticket_id=event['ticket_id']
+                ),
+                execution_options={'synchronize_session': False}
+            )
+        elif session is not None and session.end_time is None:
+            session.end_time = datetime.fromisoformat(event['end_time'])
+            session.fee = event['fee']
+            db.session.execute(
+                update(Slot).filter_by(**key).where(Slot.ticket_id == event['ticket_id']).values(
+                    status=0, vehicle_reg_no=None, ticket_id=None
+                ),
+                execution_options={'synchronize_session': False}
+            )
+
+    def apply_gate_events(events):
+        """Apply logged park/unpark events in one transaction per shard; safe to replay"""
+        with app.app_context():
+            for event in events:
+                # Flush while the event's shard is still selected
+                with lot_shard(event['parkinglot_id']):
+                    apply_gate_event(event)
+                    db.session.flush()
+            db.session.commit()
+
+    def database_unavailable(exc):
+        """Errors the writer waits out; anything else is a bad event"""
+        return (isinstance(exc, (OperationalError, InterfaceError))
+                or getattr(exc, 'connection_invalidated', False) or unavailable(exc))
+
+    event_writer = None
+    if app.config['EVENT_LOG_DIR']:
+        event_log = EventLog(
+            app.config['EVENT_LOG_DIR'],
+            segment_bytes=app.config['EVENT_LOG_SEGMENT_BYTES'],
+            fsync=app.config['EVENT_LOG_FSYNC']
+        )
+        event_writer = EventWriter(
+            event_log, apply_gate_events, batch_size=app.config['EVENT_WRITER_BATCH_SIZE'],
+            transient=database_unavailable, submit_timeout=app.config['EVENT_LOG_SUBMIT_TIMEOUT']
+        )
+
+        # Started by the first gate request rather than here, so CLI
+        # commands and the reloader's parent process never touch the log
+        @app.before_request
+        def start_event_writer():
+            if request.endpoint in ('park_car', 'remove_car_by_ticket'):
+                try:
+                    event_writer.ensure_started()
+                except (EventLogLocked, EventLogCorrupt) as e:
+                    return jsonify({'error': f'Gate event log unavailable: {e}'}), 503
+    app.extensions['event_writer'] = event_writer
+
+    def find_logged_session(ticket_id=None, plate=None):
+        """Open session as of the event log: (found in log, ParkingSession or None).
+
+        Sessions parked through the log may not be in the database yet, and
+        ones unparked through it are still open there, so pending events win.
+        """
+        pending = event_writer.pending
+        if not ticket_id:
+            logged, ticket_id = pending.plate(plate)
+            if not logged:
+                return False, None
+            if ticket_id is None:
+                return True, None
+        entry = pending.ticket(ticket_id)
+        if entry is None:
+            return False, None
+        park, closed = entry
+        if closed or park is None:
+            return True, None
+        return True, ParkingSession(
+            ticket_id=park['ticket_id'],
+            parkinglot_id=park['parkinglot_id'],
+            floor_id=park['floor_id'],
+            row_id=park['row_id'],
+            slot_id=park['slot_id'],
+            vehicle_reg_no=park['vehicle_reg_no'],
+            user_id=park['user_id'],
+            vehicle_type=park['vehicle_type'],
+            start_time=datetime.fromisoformat(park['start_time'])
+        )
+
+    # Stale session sweep
+    def sweep_stale_sessions(parkinglot_id=None, max_age_hours=None, chunk_size=None, dry_run=False):
+        """Close open sessions older than their lot's threshold and free their slots.
+
+        Sessions are processed oldest first in chunks of ``chunk_size``, each
+        chunk in its own short transaction: two set-based UPDATEs, one for
+        parking_sessions and one for slots. Rows locked by a gate in progress
+        are skipped (FOR UPDATE SKIP LOCKED) rather than waited on. Swept
+        sessions are marked ``swept`` and get no fee, since the real exit time
+        is unknown; invoices and forecasts leave them out.
+        """
+        now = datetime.utcnow()
+        if chunk_size is None:
+            chunk_size = app.config['SWEEP_CHUNK_SIZE']
+        default_hours = app.config['STALE_SESSION_HOURS']
+        hours_by_lot = app.config['STALE_SESSION_HOURS_BY_LOT']
+
+        def cutoff_for(lot_id):
+            hours = max_age_hours if max_age_hours is not None else hours_by_lot.get(lot_id, default_hours)
+            return now - timedelta(hours=hours)
+
+        if parkinglot_id is not None:
+            lot_ids = [parkinglot_id]
+        else:
+            earliest = cutoff_for(None) if max_age_hours is not None else (
+                now - timedelta(hours=min([default_hours, *hours_by_lot.values()]))
+            )
+            lot_ids = scatter(lambda: [r.parkinglot_id for r in db.session.query(ParkingSession.parkinglot_id).filter(
+                ParkingSession.end_time.is_(None),
+                ParkingSession.start_time < earliest
+            ).distinct().order_by(ParkingSession.parkinglot_id)])
+            db.session.commit()
+
+        report = {'dry_run': dry_run, 'closed_sessions': 0, 'freed_slots': 0, 'lots': {}}
+        for lot_id in lot_ids:
+            route_lot(lot_id)
+            stale = ParkingSession.query.filter(
+                ParkingSession.parkinglot_id == lot_id,
+                ParkingSession.end_time.is_(None),
+                ParkingSession.start_time < cutoff_for(lot_id)
+            )
+            if dry_run:
+                closed = stale.count()
+                if closed:
+                    report['lots'][lot_id] = {'closed_sessions': closed, 'freed_slots': None}
+                    report['closed_sessions'] += closed
+                continue
+
+            closed = freed = 0
+            while True:
+                chunk = stale.with_entities(
+                    ParkingSession.ticket_id, ParkingSession.floor_id, ParkingSession.row_id,
+                    ParkingSession.slot_id, ParkingSession.vehicle_reg_no
+                ).order_by(ParkingSession.start_time).limit(chunk_size).with_for_update(skip_locked=True).all()
+                if not chunk:
+                    db.session.commit()
+                    break
+                tickets = [s.ticket_id for s in chunk]
+
+                db.session.execute(
+                    update(ParkingSession).where(ParkingSession.ticket_id.in_(tickets)).values(end_time=now, swept=True),
+                    execution_options={'synchronize_session': False}
+                )
+                # Only free slots still holding the swept ticket; others were reused
+                freed_keys = db.session.execute(
+                    update(Slot).where(
+                        tuple_(Slot.parkinglot_id, Slot.floor_id, Slot.row_id, Slot.slot_id).in_(
+                            [(lot_id, s.floor_id, s.row_id, s.slot_id) for s in chunk]
+                        ),
+                        Slot.ticket_id.in_(tickets)
+                    ).values(status=0, vehicle_reg_no=None, ticket_id=None).returning(
+                        Slot.floor_id, Slot.row_id, Slot.slot_id
+                    ),
+                    execution_options={'synchronize_session': False}
+                ).all()
+                db.session.commit()
+
+                for floor_id, row_id, slot_id in freed_keys:
+                    slot_changed(lot_id, (floor_id, row_id, slot_id))
+                for s in chunk:
+                    vehicle_cache.invalidate(normalize_reg_no(s.vehicle_reg_no))
+                closed += len(chunk)
+                freed += len(freed_keys)
+                if len(chunk) < chunk_size:
+                    break
+
+            if closed:
+                report['lots'][lot_id] = {'closed_sessions': closed, 'freed_slots': freed}
+                report['closed_sessions'] += closed
+                report['freed_slots'] += freed
+        return report
+
+    app.extensions['sweep_stale_sessions'] = sweep_stale_sessions
+
+    @app.cli.command('sweep-stale-sessions')
+    @click.option('--lot', 'parkinglot_id', type=click.IntRange(min=1), help='Only sweep this parking lot')
+    @click.option('--max-age-hours', type=click.FloatRange(min=0, min_open=True), help='Override STALE_SESSION_HOURS')
+    @click.option('--chunk-size', type=click.IntRange(min=1), help='Sessions per transaction')
+    @click.option('--dry-run', is_flag=True, help='Only count stale sessions')
+    def sweep_stale_sessions_command(parkinglot_id, max_age_hours, chunk_size, dry_run):
+        """Close stale open parking sessions and free their slots."""
+        report = sweep_stale_sessions(parkinglot_id, max_age_hours, chunk_size, dry_run)
+        for lot_id, counts in report['lots'].items():
+            click.echo(f"lot {lot_id}: closed {counts['closed_sessions']}, freed {counts['freed_slots']}")
+        click.echo(f"total: closed {report['closed_sessions']}, freed {report['freed_slots']}")
 
     # Simple JWT token verification
     def token_required(f):
@@ -198,6 +730,7 @@ def create_app(test_config=None):
 
     # ROUTES
     @app.route('/')
+    @query_budget(statements=0)
     def home():
         return '''
         <h1>Welcome to the Car Parking System API!</h1>
@@ -213,9 +746,16 @@ def create_app(test_config=None):
         <p><strong>Protected Endpoints (require JWT):</strong></p>
         <ul>
             <li><code>/parkinglots_details</code> - View parking lots (GET)</li>
-            <li><code>/parking_lot_structure</code> - View parking structure (GET)</li>
+            <li><code>/parking_lot_structure</code> - View parking structure, optionally <code>?parkinglot_id=</code> (GET)</li>
             <li><code>/park_car</code> - Park a car (POST)</li>
-            <li><code>/remove_car_by_ticket</code> - Remove car by ticket (DELETE)</li>
+            <li><code>/remove_car_by_ticket</code> - Remove car by ticket or plate (DELETE)</li>
+            <li><code>/vehicles/&lt;reg_no&gt;</code> - Find a parked car by plate (GET)</li>
+            <li><code>/users/&lt;user_id&gt;/sessions</code> - Your parking history across all lots (GET)</li>
+            <li><code>/parkinglots/&lt;parkinglot_id&gt;/invoice</code> - Fees for closed sessions (GET)</li>
+            <li><code>/parkinglots/&lt;parkinglot_id&gt;/layout</code> - Static slot layout for display boards (GET)</li>
+            <li><code>/parkinglots/&lt;parkinglot_id&gt;/status</code> - Packed slot status bitset (GET)</li>
+            <li><code>/parkinglots/&lt;parkinglot_id&gt;/forecast</code> - Expected occupancy for the next hours (GET)</li>
+            <li><code>/admin/sweep_stale_sessions</code> - Close stale open sessions, admins only (POST)</li>
             <li><code>/users</code> - List all users (GET)</li>
             <li><code>/users/&lt;user_id&gt;</code> - Update user profile (PUT)</li>
         </ul>
@@ -225,6 +765,7 @@ def create_app(test_config=None):
 
     # Auth endpoints
     @app.route('/register', methods=['POST'])
+    @query_budget(statements=3, rows=3)
     def register():
         data = request.get_json() or {}
 
@@ -259,6 +800,7 @@ def create_app(test_config=None):
         }), 201
 
     @app.route('/login', methods=['POST'])
+    @query_budget(statements=1, rows=1)
     def login():
         data = request.get_json()
         
@@ -292,58 +834,54 @@ def create_app(test_config=None):
 
     # Protected endpoints
     @app.route('/parkinglots_details', methods=['GET'])
+    @query_budget(statements=1, per_shard=True)
     @token_required
     def get_parkinglots_details(current_user_id):
         try:
-            entries = ParkingLotDetails.query.all()
-            result = []
-            for entry in entries:
-                result.append({
+            result = scatter(lambda: [
+                {
                     'parkinglot_id': entry.parkinglot_id,
                     'parking_name': entry.parking_name,
                     'city': entry.city,
                     'landmark': entry.landmark,
                     'address': entry.address,
                     # Add other fields as needed
-                })
+                } for entry in ParkingLotDetails.query.all()
+            ])
             return jsonify(result), 200
         except Exception as e:
             return jsonify({'error': str(e)}), 500
 
     @app.route('/parking_lot_structure', methods=['GET'])
+    @query_budget(statements=4, per_shard=True)
     @token_required
     def display_parking_lot_structure(current_user_id):
         try:
-            floors = Floor.query.all()
-            result = []
-            for floor in floors:
-                floor_data = {
-                    'floor_id': floor.floor_id,
-                    'floor_name': floor.floor_name,
-                    'rows': []
-                }
-                for row in floor.rows:
-                    row_data = {
-                        'row_id': row.row_id,
-                        'row_name': row.row_name,
-                        'slots': []
-                    }
-                    for slot in row.slots:
-                        slot_data = {
-                            'slot_id': slot.slot_id,
-                            'slot_name': slot.slot_name,
-                            'status': slot.status,
-                            'vehicle_reg_no': slot.vehicle_reg_no,
-                            'ticket_id': slot.ticket_id
-                        }
-                        row_data['slots'].append(slot_data)
-                    floor_data['rows'].append(row_data)
-                result.append(floor_data)
-            return jsonify(result), 200
+            lot_id = request.args.get('parkinglot_id', type=int)
+            if lot_id is not None:
+                version, payload = structure_cache.payload(lot_id)
+                response = app.response_class(payload, mimetype='application/json')
+                response.set_etag(f'{structure_cache.epoch}-{lot_id}-{version}')
+                return response.make_conditional(request)
+
+            # All lots: join the cached per-lot floor arrays
+            lot_ids = scatter(lambda: [r.parkinglot_id for r in db.session.query(
+                Floor.parkinglot_id
+            ).distinct().order_by(Floor.parkinglot_id)])
+            parts = [payload[1:-1] for _, payload in structure_cache.payloads(lot_ids)]
+            payload = b'[' + b','.join(p for p in parts if p) + b']'
+            return app.response_class(payload, mimetype='application/json'), 200
         except Exception as e:
             return jsonify({'error': str(e)}), 500
+
+    @app.route('/parking_lot_structure/cache_stats', methods=['GET'])
+    @query_budget(statements=0)
+    @token_required
+    def structure_cache_stats(current_user_id):
+        return jsonify(structure_cache.stats()), 200
     
     @app.route('/users', methods=['GET'])
+    @query_budget(statements=1)
     @token_required
     def get_users(current_user_id):
         try:
@@ -361,6 +899,7 @@ def create_app(test_config=None):
             return jsonify({'error': str(e)}), 500
 
     @app.route('/park_car', methods=['POST'])
+    @query_budget(statements=5, scatter=1)
     @token_required
     def park_car(current_user_id):
         data = request.get_json()
@@ -369,6 +908,7 @@ def create_app(test_config=None):
         floor_id = data.get('floor_id')
         row_id = data.get('row_id')
         slot_id = data.get('slot_id')
+        vehicle_type = data.get('vehicle_type', 'car')
 
         # Get user ID from token
         user_id = current_user_id
@@ -376,11 +916,18 @@ def create_app(test_config=None):
         # Required fields check
         if not parking_lot_name or not vehicle_reg_no:
             return jsonify({'error': 'Missing required fields'}), 400
+        # Logged events are applied later, so anything the database would
+        # reject has to be caught here
+        max_reg_no = ParkingSession.vehicle_reg_no.type.length
+        if not isinstance(vehicle_reg_no, str) or len(vehicle_reg_no) > max_reg_no:
+            return jsonify({'error': f'vehicle_reg_no must be a string of at most {max_reg_no} characters'}), 400
+        if vehicle_type not in VEHICLE_TYPES:
+            return jsonify({'error': f'vehicle_type must be one of: {", ".join(VEHICLE_TYPES)}'}), 400
 
-        # Find parking lot
-        parking_lot = ParkingLotDetails.query.filter_by(
+        # Find parking lot; its shard serves the rest of the request
+        parking_lot = scatter_first(lambda: ParkingLotDetails.query.filter_by(
             parking_name=parking_lot_name
-        ).first()
+        ).first())
         if not parking_lot:
             return jsonify({'error': 'Parking lot not found'}), 404
 
@@ -396,90 +943,405 @@ def create_app(test_config=None):
             ).first()
             if not slot:
                 return jsonify({'error': 'Specified slot not found'}), 404
-            if slot.status != 0:  # 0 == available
+            if not slot_is_free(slot):
                 return jsonify({'error': 'Specified slot is not available'}), 400
+            slot_allocator.occupy(parking_lot.parkinglot_id, (floor_id, row_id, slot_id))
 
-        # Find first available slot
+        # Pick a slot using the lot's allocation policy
         if slot is None:
-            slot = Slot.query.filter_by(
-                parkinglot_id=parking_lot.parkinglot_id,
-                status=0
-            ).order_by(
-                Slot.floor_id,
-                Slot.row_id,
-                Slot.slot_id
-            ).first()
+            slot = allocate_slot(parking_lot.parkinglot_id, vehicle_type)
             if not slot:
                 return jsonify({'error': 'No available slots in the parking lot'}), 400
 
         # Generate ticket & update slot
-        ticket_id = f"TKT-{slot.slot_id}-{int(datetime.utcnow().timestamp())}"
-        slot.status = 1  # mark occupied
-        slot.vehicle_reg_no = vehicle_reg_no
-        slot.ticket_id = ticket_id
-
-        # Record the parking session
-        session = ParkingSession(
-            ticket_id=ticket_id,
-            parkinglot_id=slot.parkinglot_id,
-            floor_id=slot.floor_id,
-            row_id=slot.row_id,
-            slot_id=slot.slot_id,
-            vehicle_reg_no=vehicle_reg_no,
-            user_id=user_id,
-            start_time=datetime.utcnow()
+        ticket_id = (
+            f"TKT-{slot.parkinglot_id}-{slot.floor_id}-{slot.row_id}-{slot.slot_id}"
+            f"-{int(datetime.utcnow().timestamp() * 1000)}"
         )
-        db.session.add(session)
-        db.session.commit()
+        # Read the slot key before commit expires it, saving a refresh query
+        lot_id, key = slot.parkinglot_id, (slot.floor_id, slot.row_id, slot.slot_id)
+
+        if event_writer is not None:
+            if db.session.get(User, user_id) is None:
+                return jsonify({'error': 'User not found'}), 404
+            try:
+                event_writer.submit({
+                    'type': 'park',
+                    'ticket_id': ticket_id,
+                    'parkinglot_id': lot_id,
+                    'floor_id': key[0],
+                    'row_id': key[1],
+                    'slot_id': key[2],
+                    'vehicle_reg_no': vehicle_reg_no,
+                    'user_id': user_id,
+                    'vehicle_type': vehicle_type,
+                    'start_time': datetime.utcnow().isoformat()
+                }, normalize_reg_no(vehicle_reg_no))
+            except (EventLogFailed, TimeoutError) as e:
+                return jsonify({'error': f'Gate event log unavailable: {e}'}), 503
+        else:
+            slot.status = 1  # mark occupied
+            slot.vehicle_reg_no = vehicle_reg_no
+            slot.ticket_id = ticket_id
+
+            # Record the parking session
+            session = ParkingSession(
+                ticket_id=ticket_id,
+                parkinglot_id=slot.parkinglot_id,
+                floor_id=slot.floor_id,
+                row_id=slot.row_id,
+                slot_id=slot.slot_id,
+                vehicle_reg_no=vehicle_reg_no,
+                user_id=user_id,
+                vehicle_type=vehicle_type,
+                start_time=datetime.utcnow()
+            )
+            db.session.add(session)
+            db.session.commit()
+        vehicle_cache.invalidate(normalize_reg_no(vehicle_reg_no))
+        slot_changed(lot_id, key, vehicle_reg_no, ticket_id)
 
         return jsonify({
             'message': 'Car parked successfully',
             'ticket_id': ticket_id,
             'assigned_slot': {
-                'floor_id': slot.floor_id,
-                'row_id': slot.row_id,  # Fixed bug: was using row.row_id
-                'slot_id': slot.slot_id
+                'floor_id': key[0],
+                'row_id': key[1],  # Fixed bug: was using row.row_id
+                'slot_id': key[2]
             }
         }), 201
 
     @app.route('/remove_car_by_ticket', methods=['DELETE'])
+    @query_budget(statements=6, rows=10, scatter=1)
     @token_required
     def remove_car_by_ticket(current_user_id):
         data = request.get_json()
         ticket_id = data.get('ticket_id')
+        vehicle_reg_no = data.get('vehicle_reg_no')
 
-        if not ticket_id:
-            return jsonify({'error': 'Missing ticket_id'}), 400
+        if not ticket_id and not vehicle_reg_no:
+            return jsonify({'error': 'Missing ticket_id or vehicle_reg_no'}), 400
 
-        # Find the parking session
-        session = ParkingSession.query.get(ticket_id)
-        if not session:
+        # Find the parking session, by ticket or by the car's open session
+        logged = False
+        if event_writer is not None:
+            logged, session = find_logged_session(
+                ticket_id, vehicle_reg_no and normalize_reg_no(vehicle_reg_no)
+            )
+        if not logged:
+            if ticket_id and ticket_lot_id(ticket_id) is not None:
+                route_lot(ticket_lot_id(ticket_id))
+                session = ParkingSession.query.get(ticket_id)
+            elif ticket_id:
+                session = scatter_first(lambda: ParkingSession.query.get(ticket_id))
+            else:
+                session = scatter_first(lambda: find_open_session(normalize_reg_no(vehicle_reg_no)))
+        if not session or session.end_time is not None:
             return jsonify({'error': 'Parking session not found'}), 404
+        route_lot(session.parkinglot_id)
 
-        # Find the slot
-        slot = Slot.query.filter_by(
-            parkinglot_id=session.parkinglot_id,
-            floor_id=session.floor_id,
-            row_id=session.row_id,
-            slot_id=session.slot_id
-        ).first()
-        if not slot:
-            return jsonify({'error': 'Slot for this ticket not found'}), 404
+        end_time = datetime.utcnow()
+        if event_writer is not None:
+            lot_id, key = session.parkinglot_id, (session.floor_id, session.row_id, session.slot_id)
+            ticket_id, plate, start_time = session.ticket_id, normalize_reg_no(session.vehicle_reg_no), session.start_time
+            fee = session_fee(session, end_time)
+            freed = True  # pending events mark the slot free; the writer checks the ticket
+            try:
+                event_writer.submit({
+                    'type': 'unpark',
+                    'ticket_id': ticket_id,
+                    'parkinglot_id': lot_id,
+                    'floor_id': key[0],
+                    'row_id': key[1],
+                    'slot_id': key[2],
+                    'vehicle_reg_no': session.vehicle_reg_no,
+                    'end_time': end_time.isoformat(),
+                    'fee': fee
+                }, plate)
+            except (EventLogFailed, TimeoutError) as e:
+                return jsonify({'error': f'Gate event log unavailable: {e}'}), 503
+        else:
+            # Find the slot
+            slot = Slot.query.filter_by(
+                parkinglot_id=session.parkinglot_id,
+                floor_id=session.floor_id,
+                row_id=session.row_id,
+                slot_id=session.slot_id
+            ).first()
+            if not slot:
+                return jsonify({'error': 'Slot for this ticket not found'}), 404
 
-        # Mark slot as available and clear fields
-        slot.status = 0   # 0 = available
-        slot.vehicle_reg_no = None
-        slot.ticket_id = None
+            # Mark slot as available and clear fields, unless another car holds it now
+            freed = slot.ticket_id == session.ticket_id
+            if freed:
+                slot.status = 0   # 0 = available
+                slot.vehicle_reg_no = None
+                slot.ticket_id = None
 
-        # Close the session
-        session.end_time = datetime.utcnow()
+            # Close the session and bill it
+            session.end_time = end_time
+            session.fee = session_fee(session, end_time)
 
-        # Commit changes
-        db.session.commit()
+            # Read what the response needs before commit expires it
+            lot_id, key = slot.parkinglot_id, (slot.floor_id, slot.row_id, slot.slot_id)
+            ticket_id, plate, fee = session.ticket_id, normalize_reg_no(session.vehicle_reg_no), session.fee
+            start_time = session.start_time
+
+            # Commit changes
+            db.session.commit()
+        vehicle_cache.invalidate(plate)
+        if freed:
+            slot_changed(lot_id, key)
+        if start_time is not None:
+            forecast_model.record(lot_id, start_time, end_time)
+
+        return jsonify({
+            'message': 'Car removed successfully',
+            'ticket_id': ticket_id,
+            'fee': fee
+        }), 200
+
+    @app.route('/parkinglots/<int:parkinglot_id>/invoice', methods=['GET'])
+    @query_budget(statements=2)
+    @token_required
+    def parking_lot_invoice(current_user_id, parkinglot_id):
+        route_lot(parkinglot_id)
+        parking_lot = db.session.get(ParkingLotDetails, parkinglot_id)
+        if not parking_lot:
+            return jsonify({'error': 'Parking lot not found'}), 404
+
+        try:
+            start = request.args.get('from')
+            end = request.args.get('to')
+            # Vehicle types come back as indexes into VEHICLE_TYPES, so rows
+            # load straight into arrays
+            type_id = case(
+                {vehicle_type: type_id for type_id, vehicle_type in enumerate(VEHICLE_TYPES)},
+                value=func.coalesce(ParkingSession.vehicle_type, 'car'), else_=0
+            )
+            query = select(cast(ParkingSession.duration_hrs, Float), type_id).where(
+                ParkingSession.parkinglot_id == parkinglot_id,
+                ParkingSession.end_time.isnot(None),
+                ParkingSession.swept.is_(False)
+            )
+            if start:
+                query = query.where(ParkingSession.end_time >= datetime.fromisoformat(start))
+            if end:
+                query = query.where(ParkingSession.end_time < datetime.fromisoformat(end))
+            sessions = db.session.execute(query).all()
+        except ValueError:
+            return jsonify({'error': 'from/to must be ISO dates'}), 400
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+        # Sessions are re-priced with array math at the lot's current tariff,
+        # so the invoice follows tariff changes; the fee charged at exit stays
+        # on each session
+        columns = np.fromiter(
+            chain.from_iterable(sessions), dtype=np.float64, count=2 * len(sessions)
+        ).reshape(-1, 2)
+        hours, type_ids = columns[:, 0], columns[:, 1].astype(np.int64)
+        tariffs = [t if t is not None else UNAVAILABLE for t in tariffs_for(parking_lot)]
+        fees = bill_sessions(hours, type_ids, tariffs)
+
+        by_vehicle_type = {}
+        for type_id, vehicle_type in enumerate(VEHICLE_TYPES):
+            mask = type_ids == type_id
+            by_vehicle_type[vehicle_type] = {
+                'sessions': int(mask.sum()),
+                'total_fee': float(np.nansum(fees[mask]))
+            }
+        return jsonify({
+            'parkinglot_id': parkinglot_id,
+            'sessions': len(sessions),
+            'unbilled_sessions': int(np.isnan(fees).sum()),
+            'total_fee': float(np.nansum(fees)),
+            'by_vehicle_type': by_vehicle_type
+        }), 200
+
+    @app.route('/parkinglots/<int:parkinglot_id>/layout', methods=['GET'])
+    @query_budget(statements=3)
+    @token_required
+    def parking_lot_layout(current_user_id, parkinglot_id):
+        try:
+            floors = load_lots_structure([parkinglot_id])[parkinglot_id]
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+        if not floors:
+            return jsonify({'error': 'Parking lot not found'}), 404
+
+        # Slot order here is the bit order of /status
+        keys = []
+        for floor in floors:
+            for row in floor['rows']:
+                row['slots'] = [[slot['slot_id'], slot['slot_name']] for slot in row['slots']]
+                keys.extend((floor['floor_id'], row['row_id'], slot_id) for slot_id, _ in row['slots'])
+        version = layout_version(keys)
+
+        response = jsonify({
+            'parkinglot_id': parkinglot_id,
+            'layout_version': version,
+            'slot_count': len(keys),
+            'floors': floors
+        })
+        response.set_etag(version)
+        response.cache_control.public = True
+        response.cache_control.max_age = app.config['LAYOUT_MAX_AGE']
+        return response.make_conditional(request)
+
+    @app.route('/parkinglots/<int:parkinglot_id>/status', methods=['GET'])
+    @query_budget(statements=1)
+    @token_required
+    def parking_lot_status(current_user_id, parkinglot_id):
+        try:
+            status = status_board.lot(parkinglot_id)
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+        if not status.keys:
+            return jsonify({'error': 'Parking lot not found'}), 404
+
+        # A delta against the client's version, unless a full bitset is smaller
+        version, encoding, body = status.snapshot(request.args.get('since'))
+
+        response = app.response_class(body, mimetype='application/octet-stream')
+        response.headers['X-Lot-Version'] = version
+        response.headers['X-Layout-Version'] = status.layout_version
+        response.headers['X-Slot-Count'] = str(len(status.keys))
+        response.headers['X-Status-Encoding'] = encoding
+        return response
 
-        return jsonify({'message': 'Car removed successfully'}), 200
+    @app.route('/parkinglots/<int:parkinglot_id>/forecast', methods=['GET'])
+    @query_budget(statements=2)
+    @token_required
+    def parking_lot_forecast(current_user_id, parkinglot_id):
+        hours = request.args.get('hours', 24, type=int)
+        if not 1 <= hours <= 168:
+            return jsonify({'error': 'hours must be between 1 and 168'}), 400
+
+        route_lot(parkinglot_id)
+        try:
+            capacity, occupied = db.session.query(
+                func.count(Slot.slot_id),
+                func.coalesce(func.sum(case((Slot.status == 1, 1), else_=0)), 0)
+            ).filter(Slot.parkinglot_id == parkinglot_id).one()
+            if not capacity:
+                return jsonify({'error': 'Parking lot not found'}), 404
+
+            result = forecast_model.forecast(
+                parkinglot_id, datetime.utcnow(), int(occupied), capacity, hours
+            )
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+        return jsonify({
+            'parkinglot_id': parkinglot_id,
+            'capacity': capacity,
+            'occupied': int(occupied),
+            **result
+        }), 200
+
+    @app.route('/vehicles/<reg_no>', methods=['GET'])
+    @query_budget(statements=2, rows=2, per_shard=True)
+    @token_required
+    def find_vehicle(current_user_id, reg_no):
+        plate = normalize_reg_no(reg_no)
+        cached = vehicle_cache.get(plate)
+        if cached is not None:
+            return jsonify(cached), 200
+        generation = vehicle_cache.generation(plate)
+
+        try:
+            session = scatter_first(lambda: find_open_session(plate))
+            if not session:
+                return jsonify({'error': 'Vehicle is not currently parked'}), 404
+
+            parking_lot = db.session.get(ParkingLotDetails, session.parkinglot_id)
+            result = {
+                'vehicle_reg_no': session.vehicle_reg_no,
+                'ticket_id': session.ticket_id,
+                'parkinglot_id': session.parkinglot_id,
+                'parking_name': parking_lot.parking_name if parking_lot else None,
+                'floor_id': session.floor_id,
+                'row_id': session.row_id,
+                'slot_id': session.slot_id,
+                'start_time': session.start_time.isoformat() if session.start_time else None
+            }
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+        vehicle_cache.set(plate, result, generation)
+        return jsonify(result), 200
+
+    @app.route('/admin/sweep_stale_sessions', methods=['POST'])
+    @query_budget(statements=None)  # chunked batch job, scales with the number of stale sessions
+    @token_required
+    def admin_sweep_stale_sessions(current_user_id):
+        if int(current_user_id) not in app.config['ADMIN_USER_IDS']:
+            return jsonify({'error': 'Admin access required'}), 403
+
+        data = request.get_json(silent=True) or {}
+        # Only explicit positive numbers override the configured defaults
+        for field, types in (('parkinglot_id', int), ('max_age_hours', (int, float)), ('chunk_size', int)):
+            value = data.get(field)
+            if value is not None and (isinstance(value, bool) or not isinstance(value, types) or value <= 0):
+                kind = 'number' if field == 'max_age_hours' else 'integer'
+                return jsonify({'error': f'{field} must be a positive {kind}'}), 400
+        try:
+            report = sweep_stale_sessions(
+                parkinglot_id=data.get('parkinglot_id'),
+                max_age_hours=data.get('max_age_hours'),
+                chunk_size=data.get('chunk_size'),
+                dry_run=bool(data.get('dry_run'))
+            )
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 500
+
+        return jsonify(report), 200
+
+    @app.route('/users/<int:user_id>/sessions', methods=['GET'])
+    @query_budget(statements=1, per_shard=True)
+    @token_required
+    def user_sessions(current_user_id, user_id):
+        if int(current_user_id) != user_id:
+            return jsonify({'error': 'You can only view your own parking history'}), 403
+        limit = request.args.get('limit', 50, type=int)
+        if not 1 <= limit <= 500:
+            return jsonify({'error': 'limit must be between 1 and 500'}), 400
+
+        # Newest first from every shard, merged and cut to the overall newest
+        def newest_sessions():
+            return [[
+                {
+                    'ticket_id': s.ticket_id,
+                    'parkinglot_id': s.parkinglot_id,
+                    'floor_id': s.floor_id,
+                    'row_id': s.row_id,
+                    'slot_id': s.slot_id,
+                    'vehicle_reg_no': s.vehicle_reg_no,
+                    'vehicle_type': s.vehicle_type,
+                    'start_time': s.start_time.isoformat() if s.start_time else None,
+                    'end_time': s.end_time.isoformat() if s.end_time else None,
+                    'fee': float(s.fee) if s.fee is not None else None
+                } for s in db.session.query(
+                    ParkingSession.ticket_id, ParkingSession.parkinglot_id, ParkingSession.floor_id,
+                    ParkingSession.row_id, ParkingSession.slot_id, ParkingSession.vehicle_reg_no,
+                    ParkingSession.vehicle_type, ParkingSession.start_time, ParkingSession.end_time,
+                    ParkingSession.fee
+                ).filter(
+                    ParkingSession.user_id == user_id, ParkingSession.start_time.isnot(None)
+                ).order_by(ParkingSession.start_time.desc()).limit(limit)
+            ]]
+
+        try:
+            per_shard = scatter(newest_sessions)
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+        merged = heapq.merge(*per_shard, key=lambda s: s['start_time'], reverse=True)
+        return jsonify(list(merged)[:limit]), 200
 
     @app.route('/users/<int:user_id>', methods=['PUT'])
+    @query_budget(statements=3, rows=3)
     @token_required
     def update_user(current_user_id, user_id):
         # Only allow users to update their own profile
@@ -527,7 +1389,12 @@ def create_app(test_config=None):
             }
         }), 200
 
-    # Create all tables if they don't exist
+    # Create all tables if they don't exist, with the lot tables on every shard
+    for key in lot_router.shards():
+        if key is not None:
+            if key not in db.metadatas:
+                raise ValueError(f"LOT_SHARDS bind {key!r} is not in SQLALCHEMY_BINDS")
+            add_lot_tables(db.metadatas[key], LOT_TABLES)
     with app.app_context():
         db.create_all()
 
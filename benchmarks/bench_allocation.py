@@ -0,0 +1,112 @@
+"""Simulate gate traffic against each slot allocation policy.
+
+Compares the precomputed-ordering allocator with the old approach of sorting
+the free slots on every arrival (what ORDER BY floor_id, row_id, slot_id did
+in SQL), and reports how evenly each policy spreads cars across floors.
+
+    python benchmarks/bench_allocation.py --floors 5 --rows 20 --slots 50
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from allocation import LotAllocator, POLICIES  # noqa: E402
+
+
+def build_layout(floors, rows, slots):
+    return [
+        (floor_id, row_id, slot_id)
+        for floor_id in range(1, floors + 1)
+        for row_id in range(1, rows + 1)
+        for slot_id in range(1, slots + 1)
+    ]
+
+
+def floor_balance(occupied, floors):
+    """Coefficient of variation of per-floor occupancy (0 = perfectly even)."""
+    counts = [0] * floors
+    for floor_id, _, _ in occupied:
+        counts[floor_id - 1] += 1
+    mean = statistics.mean(counts)
+    return statistics.pstdev(counts) / mean if mean else 0.0
+
+
+def simulate(allocate, release, steps, occupancy, capacity, seed):
+    """Drive arrivals/departures so the lot hovers around ``occupancy``."""
+    rng = random.Random(seed)
+    parked = []
+    latencies = []
+    balance = []
+    for step in range(steps):
+        if parked and (len(parked) >= capacity * occupancy or rng.random() < 0.4):
+            key = parked.pop(rng.randrange(len(parked)))
+            release(key)
+        else:
+            start = time.perf_counter()
+            key = allocate()
+            latencies.append(time.perf_counter() - start)
+            if key is not None:
+                parked.append(key)
+        if step % 100 == 0:
+            balance.append(parked[:])
+    return latencies, balance
+
+
+def run_policy(name, layout, args, vehicle_type='car'):
+    options = {}
+    if name == 'two_wheeler_reserved':
+        options['reserved_rows'] = [(1, 1)]
+    lot = LotAllocator(layout, layout, name, **options)
+    return simulate(
+        lambda: lot.pop(vehicle_type), lot.release,
+        args.steps, args.occupancy, len(layout), args.seed
+    )
+
+
+def run_sort_baseline(layout, args):
+    free = set(layout)
+
+    def allocate():
+        if not free:
+            return None
+        key = min(free)
+        free.discard(key)
+        return key
+
+    return simulate(allocate, free.add, args.steps, args.occupancy, len(layout), args.seed)
+
+
+def report(name, latencies, snapshots, floors):
+    latencies_us = sorted(l * 1e6 for l in latencies)
+    p50 = latencies_us[len(latencies_us) // 2]
+    p99 = latencies_us[int(len(latencies_us) * 0.99)]
+    balance = statistics.mean(floor_balance(s, floors) for s in snapshots if s)
+    print(f'{name:<22} {p50:>10.2f} {p99:>10.2f} {balance:>14.3f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--floors', type=int, default=5)
+    parser.add_argument('--rows', type=int, default=20)
+    parser.add_argument('--slots', type=int, default=50)
+    parser.add_argument('--steps', type=int, default=50000)
+    parser.add_argument('--occupancy', type=float, default=0.6)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    layout = build_layout(args.floors, args.rows, args.slots)
+    print(f'{len(layout)} slots, {args.steps} gate events, target occupancy {args.occupancy:.0%}')
+    print(f'{"policy":<22} {"p50 us":>10} {"p99 us":>10} {"floor CoV":>14}')
+
+    report('sort (old behaviour)', *run_sort_baseline(layout, args), args.floors)
+    for name in POLICIES:
+        report(name, *run_policy(name, layout, args), args.floors)
+
+
+if __name__ == '__main__':
+    main()
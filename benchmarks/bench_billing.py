@@ -0,0 +1,67 @@
+"""Throughput of bulk billing: vectorized bill_sessions vs a per-session loop.
+
+    python benchmarks/bench_billing.py --sessions 1000000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from billing import bill_sessions, parse_tariff  # noqa: E402
+
+# A mix of the charge formats found in the parking data
+CHARGES = [
+    'Rs 20 per hour',
+    'Rs 10 per hour max 100',
+    '20 up to 6 hours 30 for 12 hours',
+    '20rs for first 6 hours 30 rs beyond that.',
+    '20 rs for first hour 10 for the next subsequent hours',
+    '10 rs per hour 50 rs one hour onwards for the entire day.',
+    'Rs 10 per Parking',
+    'Free parking.',
+    'Not applicable.',
+]
+
+
+def loop_billing(hours, tariff_ids, tariffs):
+    return [tariffs[t].fee(h) for h, t in zip(hours.tolist(), tariff_ids.tolist())]
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=1000000)
+    parser.add_argument('--lots', type=int, default=1000, help='distinct lots (each gets a tariff from CHARGES)')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    tariffs = [parse_tariff(CHARGES[i % len(CHARGES)]) for i in range(args.lots)]
+    # Most stays are short, a few run for days; durations are rounded like duration_hrs
+    hours = np.round(rng.lognormal(mean=0.7, sigma=1.0, size=args.sessions), 1)
+    tariff_ids = rng.integers(0, args.lots, size=args.sessions)
+
+    vectorized, vector_time = timed(bill_sessions, hours, tariff_ids, tariffs)
+    looped, loop_time = timed(loop_billing, hours, tariff_ids, tariffs)
+
+    expected = np.array([np.nan if fee is None else fee for fee in looped])
+    assert np.allclose(vectorized, expected, equal_nan=True), 'vectorized and loop results differ'
+
+    print(f'{args.sessions} sessions across {args.lots} tariffs')
+    print(f'{"method":<12} {"seconds":>10} {"sessions/s":>14}')
+    print(f'{"loop":<12} {loop_time:>10.3f} {args.sessions / loop_time:>14,.0f}')
+    print(f'{"vectorized":<12} {vector_time:>10.3f} {args.sessions / vector_time:>14,.0f}')
+    print(f'speedup: {loop_time / vector_time:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
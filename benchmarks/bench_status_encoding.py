@@ -0,0 +1,82 @@
+"""Size and encode time of slot status: JSON lot structure vs packed bitset vs delta.
+
+    python benchmarks/bench_status_encoding.py --floors 5 --rows 20 --slots 50
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from slot_status import LotStatus  # noqa: E402
+
+
+def build_structure(floors, rows, slots, occupied):
+    """The /parking_lot_structure?parkinglot_id= document for one lot."""
+    bits = iter(occupied)
+    structure = []
+    for floor_id in range(1, floors + 1):
+        floor_rows = []
+        for row_id in range(1, rows + 1):
+            row_slots = []
+            for slot_id in range(1, slots + 1):
+                taken = next(bits)
+                row_slots.append({
+                    'slot_id': slot_id,
+                    'slot_name': f'{row_id}-{slot_id}',
+                    'status': int(taken),
+                    'vehicle_reg_no': f'KA01AB{slot_id:04d}' if taken else None,
+                    'ticket_id': f'TKT-1-{floor_id}-{row_id}-{slot_id}-1700000000000' if taken else None
+                })
+            floor_rows.append({'row_id': row_id, 'row_name': f'R{row_id}', 'slots': row_slots})
+        structure.append({'floor_id': floor_id, 'floor_name': f'Floor {floor_id}', 'rows': floor_rows})
+    return structure
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--floors', type=int, default=5)
+    parser.add_argument('--rows', type=int, default=20)
+    parser.add_argument('--slots', type=int, default=50, help='slots per row')
+    parser.add_argument('--occupancy', type=float, default=0.6)
+    parser.add_argument('--changes', type=int, default=20, help='park/unpark events between two polls')
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    keys = [(f, r, s) for f in range(1, args.floors + 1)
+            for r in range(1, args.rows + 1) for s in range(1, args.slots + 1)]
+    occupied = rng.random(len(keys)) < args.occupancy
+    structure = build_structure(args.floors, args.rows, args.slots, occupied)
+
+    status = LotStatus(keys, occupied)
+    since = status.version
+    for i in rng.choice(len(keys), size=args.changes, replace=False):
+        status.set(keys[i], not status.bits[i])
+
+    payloads = [
+        ('json', lambda: json.dumps(structure, separators=(',', ':')).encode()),
+        ('bitset', status.packed),
+        ('delta', lambda: status.delta_since(since)),
+    ]
+    print(f'{len(keys)} slots, {args.occupancy:.0%} occupied, {args.changes} changes since last poll')
+    print(f'{"encoding":<10} {"bytes":>10} {"encode us":>12}')
+    for name, encode in payloads:
+        body, seconds = timed(encode, args.repeat)
+        print(f'{name:<10} {len(body):>10,} {seconds * 1e6:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""Parking tariffs and fee calculation.
+
+``car_parking_charge`` and ``two_wheeler_parking_charge`` are free text
+("Rs 20 per hour", "20 up to 6 hours 30 for 12 hours", "Free parking.").
+``parse_tariff`` turns them into a ``Tariff`` once; ``Tariff.fee`` prices a
+single session at exit and ``bill_sessions`` prices large batches with NumPy.
+
+Pricing model, applied to each 24 hour day of a stay:
+
+* ``flat``: one charge for the whole visit, whatever the duration.
+* ``steps``: ``(up_to_hours, charge)`` pairs; the first step covering the
+  time parked is charged, ``beyond`` (or the last step) after that.
+* otherwise ``first_charge`` covers ``first_hours`` and every started hour
+  after that costs ``hourly_rate``.
+
+``daily_cap`` limits the charge for any one day.
+"""
+import math
+import re
+from dataclasses import dataclass
+
+import numpy as np
+
+UNAVAILABLE_MARKERS = ('not applicable', 'not available', 'not allowed', 'no cars', 'no 2 wheelers')
+FREE_MARKERS = ('free', 'no charge')
+
+_NUMBER = r'(\d+(?:\.\d+)?)'
+_RS = r'\s*(?:rs\.?)?\s*'
+
+
+@dataclass(frozen=True)
+class Tariff:
+    available: bool = True
+    flat: float = None
+    steps: tuple = ()
+    beyond: float = None
+    first_hours: float = 1.0
+    first_charge: float = 0.0
+    hourly_rate: float = 0.0
+    daily_cap: float = None
+
+    def _day_fee(self, hours):
+        if self.steps:
+            for up_to, charge in self.steps:
+                if hours <= up_to:
+                    fee = charge
+                    break
+            else:
+                fee = self.beyond if self.beyond is not None else self.steps[-1][1]
+        else:
+            extra_hours = max(math.ceil(hours - self.first_hours), 0)
+            fee = self.first_charge + extra_hours * self.hourly_rate
+        if self.daily_cap is not None:
+            fee = min(fee, self.daily_cap)
+        return fee
+
+    def fee(self, hours):
+        """Fee for one session of ``hours``, or None if the vehicle type is not allowed."""
+        if not self.available:
+            return None
+        if self.flat is not None:
+            return float(self.flat)
+        days, remainder = divmod(max(float(hours), 0.0), 24.0)
+        fee = days * self._day_fee(24.0)
+        if remainder > 0 or days == 0:
+            fee += self._day_fee(remainder)
+        return float(fee)
+
+    def fees(self, hours):
+        """Vectorized ``fee`` over an array of durations (NaN where not allowed)."""
+        hours = np.maximum(np.asarray(hours, dtype=np.float64), 0.0)
+        if not self.available:
+            return np.full(hours.shape, np.nan)
+        if self.flat is not None:
+            return np.full(hours.shape, float(self.flat))
+        days = np.floor(hours / 24.0)
+        remainder = hours - days * 24.0
+        fee = days * self._day_fee(24.0) + self._day_fees(remainder)
+        # A whole number of days has no partial day to charge
+        return np.where((remainder == 0) & (days > 0), days * self._day_fee(24.0), fee)
+
+    def _day_fees(self, hours):
+        if self.steps:
+            up_to = np.array([s[0] for s in self.steps], dtype=np.float64)
+            charges = np.array(
+                [s[1] for s in self.steps]
+                + [self.beyond if self.beyond is not None else self.steps[-1][1]],
+                dtype=np.float64
+            )
+            fee = charges[np.searchsorted(up_to, hours, side='left')]
+        else:
+            extra_hours = np.maximum(np.ceil(hours - self.first_hours), 0.0)
+            fee = self.first_charge + extra_hours * self.hourly_rate
+        if self.daily_cap is not None:
+            fee = np.minimum(fee, self.daily_cap)
+        return fee
+
+
+FREE = Tariff(first_charge=0.0, hourly_rate=0.0)
+UNAVAILABLE = Tariff(available=False)
+
+
+def _cap(text):
+    match = re.search(r'max' + _RS + _NUMBER, text) or re.search(_NUMBER + _RS + r'max', text)
+    if match:
+        return float(match.group(1))
+    match = re.search(_NUMBER + _RS + r'(?:one hour onwards )?for the entire day', text)
+    return float(match.group(1)) if match else None
+
+
+def parse_tariff(charge):
+    """Parse a free-text parking charge into a Tariff.
+
+    Raises ValueError when the text does not match any known pattern.
+    """
+    text = ' '.join((charge or '').lower().split()).rstrip('.')
+    if not text or any(marker in text for marker in UNAVAILABLE_MARKERS):
+        return UNAVAILABLE
+    if any(marker in text for marker in FREE_MARKERS):
+        return FREE
+
+    match = re.search(_NUMBER + _RS + r'per parking', text)
+    if match:
+        return Tariff(flat=float(match.group(1)))
+
+    # "20 up to 6 hours 30 for 12 hours", "20rs for first 6 hours 30 rs beyond that"
+    steps = re.findall(
+        _NUMBER + _RS + r'(?:up ?to\s+' + _NUMBER + r'|for (?:first )?' + _NUMBER + r'\s*hours?)', text
+    )
+    if steps:
+        beyond = re.search(_NUMBER + _RS + r'beyond', text)
+        return Tariff(
+            steps=tuple(sorted((float(up_to or hours), float(c)) for c, up_to, hours in steps)),
+            beyond=float(beyond.group(1)) if beyond else None
+        )
+
+    # "20 rs for first hour 10 for the next subsequent hours", "20 for 1st hour 100 max"
+    match = re.search(_NUMBER + _RS + r'for (?:the )?(?:first|1st) hour', text)
+    if match:
+        first_charge = float(match.group(1))
+        after = re.search(_NUMBER + _RS + r'(?:reduces )?(?:for (?:the )?next|after)', text)
+        return Tariff(
+            first_charge=first_charge,
+            hourly_rate=float(after.group(1)) if after else first_charge,
+            daily_cap=_cap(text)
+        )
+
+    # "Rs 20 per hour", "20 per hour max 100"
+    match = re.search(_NUMBER + _RS + r'per hours?', text)
+    if match:
+        rate = float(match.group(1))
+        return Tariff(first_charge=rate, hourly_rate=rate, daily_cap=_cap(text))
+
+    raise ValueError(f'Unrecognised parking charge: {charge!r}')
+
+
+def bill_sessions(hours, tariff_ids, tariffs):
+    """Price many sessions at once.
+
+    ``hours`` and ``tariff_ids`` are parallel arrays; ``tariff_ids[i]`` indexes
+    into ``tariffs``. Sessions are sorted by tariff once and each distinct
+    tariff is applied to its slice with a handful of array operations, instead
+    of a Python loop per session. Returns a float array with NaN for sessions
+    that cannot be billed.
+    """
+    hours = np.asarray(hours, dtype=np.float64)
+    fees = np.full(hours.shape, np.nan)
+    if not hours.size:
+        return fees
+    # Many lots share a tariff; price each distinct Tariff once
+    distinct = {}
+    remap = np.array([distinct.setdefault(t, len(distinct)) for t in tariffs], dtype=np.int64)
+    tariffs = list(distinct)
+    tariff_ids = remap[np.asarray(tariff_ids)]
+    order = np.argsort(tariff_ids, kind='stable')
+    sorted_ids = tariff_ids[order]
+    bounds = np.concatenate(([0], np.flatnonzero(np.diff(sorted_ids)) + 1, [len(order)]))
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        group = order[start:end]
+        fees[group] = tariffs[sorted_ids[start]].fees(hours[group])
+    return fees
@@ -0,0 +1,273 @@
+"""Small in-process caches used by the API."""
+import json
+import secrets
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+def retained_bytes(value):
+    """Approximate memory held by a tree of dicts, lists and strings.
+
+    Small ints and None are shared by the interpreter and not counted.
+    """
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(retained_bytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(retained_bytes(v) for v in value)
+    if isinstance(value, str):
+        return sys.getsizeof(value)
+    return 0
+
+
+class PlateCache:
+    """LRU cache of vehicle lookups keyed by normalized registration number.
+
+    Entries expire after ``ttl`` seconds so other workers' park/unpark
+    operations are picked up eventually; this process invalidates a plate
+    explicitly whenever it parks or removes that vehicle.
+
+    A lookup that races with a park/unpark could cache what it read before
+    the change. Callers read ``generation(plate)`` before querying and pass
+    it to ``set``, which drops the value if the plate was invalidated in
+    between. Generations are kept for the ``maxsize`` most recently
+    invalidated plates; older ones share the last forgotten generation,
+    which only ever makes ``set`` skip more.
+    """
+
+    def __init__(self, maxsize=10000, ttl=30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.generations = OrderedDict()  # plate -> clock value of its last invalidation
+        self.clock = 0
+        self.forgotten = 0
+        self.lock = threading.Lock()
+
+    def get(self, plate):
+        with self.lock:
+            entry = self.entries.get(plate)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self.entries[plate]
+                return None
+            self.entries.move_to_end(plate)
+            return value
+
+    def generation(self, plate):
+        with self.lock:
+            return self.generations.get(plate, self.forgotten)
+
+    def set(self, plate, value, generation=None):
+        with self.lock:
+            if generation is not None and self.generations.get(plate, self.forgotten) != generation:
+                return  # invalidated while the value was being read
+            self.entries[plate] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(plate)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, plate):
+        with self.lock:
+            self.entries.pop(plate, None)
+            self.clock += 1
+            self.generations[plate] = self.clock
+            self.generations.move_to_end(plate)
+            while len(self.generations) > self.maxsize:
+                _, self.forgotten = self.generations.popitem(last=False)
+
+
+class StructureCache:
+    """Per-lot cache of the serialized floors -> rows -> slots payload.
+
+    ``builder(lot_ids)`` returns ``{lot_id: floors}`` as plain dicts for all
+    the lots it is given, so a listing of many cold lots is one build. Each
+    floor is kept as its own JSON fragment, so a park/unpark only patches one
+    slot dict and re-serializes that floor when the payload is next read; the
+    full payload is a join of the fragments. Every change bumps the lot
+    version. Versions count from 1 in every process, so ``epoch`` (random per
+    cache) must be part of anything that names a version outside this
+    process, such as an ETag.
+
+    Builds run outside the cache lock. Slot changes and invalidations that
+    arrive while a lot is being built are recorded and replayed onto the new
+    entry, since the build may have read the database before they committed.
+
+    Lots are evicted least-recently-used once the cache holds more than
+    ``max_bytes``, counting the fragments and an estimate of the slot dicts
+    and slot index kept for patching. Entries older than ``ttl`` seconds are
+    rebuilt so changes made by other workers show up.
+    """
+
+    def __init__(self, builder, max_bytes=64 * 1024 * 1024, ttl=5):
+        self.builder = builder
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.versions = {}
+        self.loading = {}  # lot_id -> [changes seen since each in-flight build started]
+        self.size = 0
+        self.epoch = secrets.token_hex(4)
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.patches = self.evictions = 0
+
+    def _bump(self, lot_id):
+        self.versions[lot_id] = self.versions.get(lot_id, 0) + 1
+        return self.versions[lot_id]
+
+    def _drop(self, lot_id):
+        entry = self.entries.pop(lot_id, None)
+        if entry is not None:
+            self.size -= entry['retained'] + sum(len(f) for f in entry['fragments'] if f is not None)
+
+    def _entry(self, floors, changes):
+        """Index a built lot and replay ``changes``; None if one of them needs a rebuild."""
+        slots = {}
+        for position, floor in enumerate(floors):
+            for row in floor['rows']:
+                for slot in row['slots']:
+                    slots[(floor['floor_id'], row['row_id'], slot['slot_id'])] = (position, slot)
+        for change in changes:
+            if change is None or change[0] not in slots:
+                return None
+            slots[change[0]][1].update(change[1])
+        return {
+            'built_at': time.monotonic(),
+            'floors': floors,
+            'slots': slots,
+            'fragments': [None] * len(floors),
+            'retained': retained_bytes(floors) + sys.getsizeof(slots) + sum(
+                sys.getsizeof(key) + sys.getsizeof(located) for key, located in slots.items()
+            )
+        }
+
+    def _build(self, lot_ids):
+        """Build and install ``lot_ids`` without holding the lock."""
+        while lot_ids:
+            with self.lock:
+                changes = {lot_id: [] for lot_id in lot_ids}
+                for lot_id in lot_ids:
+                    self.loading.setdefault(lot_id, []).append(changes[lot_id])
+            try:
+                built = self.builder(lot_ids)
+            finally:
+                with self.lock:
+                    for lot_id in lot_ids:
+                        self.loading[lot_id].remove(changes[lot_id])
+                        if not self.loading[lot_id]:
+                            del self.loading[lot_id]
+            with self.lock:
+                rebuild = []
+                for lot_id in lot_ids:
+                    if lot_id in self.entries:
+                        continue  # a concurrent build installed it first
+                    entry = self._entry(built.get(lot_id, []), changes[lot_id])
+                    if entry is None:
+                        rebuild.append(lot_id)
+                        continue
+                    entry['version'] = self._bump(lot_id)
+                    self.entries[lot_id] = entry
+                    self.size += entry['retained']
+            lot_ids = rebuild
+
+    def payload(self, lot_id):
+        """Return ``(version, json_bytes)`` for a lot, building it on a miss."""
+        return self.payloads([lot_id])[0]
+
+    def payloads(self, lot_ids):
+        """Return ``(version, json_bytes)`` for each lot, building all misses at once."""
+        counted = False
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                missing = []
+                for lot_id in lot_ids:
+                    entry = self.entries.get(lot_id)
+                    if entry is not None and entry['built_at'] + self.ttl < now:
+                        self._drop(lot_id)
+                        entry = None
+                    if entry is None:
+                        missing.append(lot_id)
+                if not counted:
+                    self.hits += len(lot_ids) - len(missing)
+                    self.misses += len(missing)
+                    counted = True
+                if not missing:
+                    return self._render(lot_ids)
+            self._build(missing)
+
+    def _render(self, lot_ids):
+        results = []
+        for lot_id in lot_ids:
+            entry = self.entries[lot_id]
+            self.entries.move_to_end(lot_id)
+            fragments = entry['fragments']
+            for position, fragment in enumerate(fragments):
+                if fragment is None:
+                    fragment = json.dumps(entry['floors'][position], separators=(',', ':')).encode()
+                    fragments[position] = fragment
+                    self.size += len(fragment)
+            results.append((entry['version'], b'[' + b','.join(fragments) + b']'))
+
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            evicted = next(iter(self.entries))
+            self._drop(evicted)
+            self.evictions += 1
+        return results
+
+    def update_slot(self, lot_id, key, **fields):
+        """Apply a slot change: patch the cached slot, or drop the lot if it is unknown."""
+        with self.lock:
+            version = self._bump(lot_id)
+            for changes in self.loading.get(lot_id, ()):
+                changes.append((key, fields))
+            entry = self.entries.get(lot_id)
+            if entry is None:
+                return version
+            located = entry['slots'].get(key)
+            if located is None:
+                self._drop(lot_id)
+                return version
+            position, slot = located
+            before = retained_bytes(slot)
+            slot.update(fields)
+            after = retained_bytes(slot)
+            entry['retained'] += after - before
+            self.size += after - before
+            fragment = entry['fragments'][position]
+            if fragment is not None:
+                self.size -= len(fragment)
+                entry['fragments'][position] = None
+            entry['version'] = version
+            self.patches += 1
+            return version
+
+    def invalidate(self, lot_id=None):
+        """Drop cached structure, e.g. after floors/rows/slots are added."""
+        with self.lock:
+            for cached in ([lot_id] if lot_id is not None else list(self.entries) + list(self.loading)):
+                self._drop(cached)
+                self._bump(cached)
+                for changes in self.loading.get(cached, ()):
+                    changes.append(None)
+
+    def version(self, lot_id):
+        with self.lock:
+            return self.versions.get(lot_id, 0)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'lots': len(self.entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'patches': self.patches,
+                'evictions': self.evictions
+            }
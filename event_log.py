@@ -0,0 +1,441 @@
+"""Write-ahead event log for gate traffic.
+
+With ``EVENT_LOG_DIR`` set, park/unpark requests are acknowledged once their
+event is on local disk instead of after a database commit:
+
+* ``EventLog`` appends events as checksummed JSON lines to segment files in
+  one directory. A flusher thread writes and fsyncs whatever has queued up
+  since the last fsync, so concurrent gates share one fsync (group commit).
+* ``EventWriter`` applies durable events to the database in batches, one
+  transaction per batch, and records the last applied sequence number in
+  ``applied``. On start it replays everything after that checkpoint. The
+  apply function must be idempotent, since a crash between the database
+  commit and the checkpoint write replays that batch again.
+* ``PendingEvents`` is the overlay of logged-but-not-applied events that the
+  gate consults, so it never hands out a slot or closes a session based on
+  database state the log has already moved past.
+
+Nothing touches the directory until ``EventWriter.start()``, which takes an
+exclusive lock on it first, so only one process at a time can write or
+replay a log directory.
+
+Events that cannot be applied (a failing batch is retried one event at a
+time to find them) are moved to ``dead_letter`` in the same line format and
+logged at CRITICAL, so one bad event does not hold up the rest of the log.
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = '.log'
+CHECKPOINT = 'applied'
+DEAD_LETTER = 'dead_letter'
+LOCK = 'lock'
+
+
+class EventLogCorrupt(Exception):
+    pass
+
+
+class EventLogLocked(Exception):
+    pass
+
+
+class EventLogFailed(Exception):
+    """A write or fsync failed; nothing more can be made durable until restart."""
+
+
+def encode(seq, event):
+    body = json.dumps(dict(event, seq=seq), separators=(',', ':'), default=str).encode()
+    return b'%08x %s\n' % (zlib.crc32(body), body)
+
+
+def decode(line):
+    """Return the event of a log line, or None for a torn or corrupt line."""
+    if not line.endswith(b'\n') or len(line) < 10:
+        return None
+    checksum, body = line[:8], line[9:-1]
+    try:
+        if int(checksum, 16) != zlib.crc32(body):
+            return None
+        return json.loads(body)
+    except ValueError:
+        return None
+
+
+class EventLog:
+    """Append-only, fsync-batched log split into segments of ``segment_bytes``."""
+
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024, fsync=True):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.durable = queue.Queue()  # (seq, event) once on disk, for the writer
+        self.lock = threading.Condition()
+        self.buffer = []
+        self.written_seq = 0
+        self.closed = False
+        self.failed = None
+        self.lock_file = None
+        self.flusher = None
+
+    def open(self):
+        """Lock the directory, cut off a torn tail and start the flusher."""
+        os.makedirs(self.directory, exist_ok=True)
+        self.lock_file = open(os.path.join(self.directory, LOCK), 'a')
+        if fcntl is not None:
+            try:
+                fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self.lock_file.close()
+                raise EventLogLocked(f'{self.directory} is in use by another process')
+        else:
+            logger.warning('cannot lock %s on this platform; give each process its own directory', self.directory)
+        try:
+            self.next_seq = self.recover() + 1
+            self.written_seq = self.next_seq - 1
+            self.file = open(self.segment_path(self.segments()[-1] if self.segments() else self.next_seq), 'ab')
+        except BaseException:
+            # Closing the lock file releases the flock, so a fixed log can be opened again
+            self.lock_file.close()
+            self.lock_file = None
+            raise
+        self.flusher = threading.Thread(target=self.flush_loop, name='event-log-flusher', daemon=True)
+        self.flusher.start()
+        return self
+
+    def segment_path(self, first_seq):
+        return os.path.join(self.directory, f'{first_seq:020d}{SEGMENT_SUFFIX}')
+
+    def segments(self):
+        """First sequence numbers of the segment files, oldest first."""
+        return sorted(
+            int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.directory)
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+
+    def recover(self):
+        """Find the last complete event, cutting off a torn write at the end of the log."""
+        last_seq = 0
+        segments = self.segments()
+        for i, first_seq in enumerate(segments):
+            path = self.segment_path(first_seq)
+            with open(path, 'rb') as f:
+                offset = 0
+                for line in f:
+                    event = decode(line)
+                    if event is None:
+                        if i != len(segments) - 1:
+                            raise EventLogCorrupt(f'{path}: bad record at byte {offset}')
+                        logger.warning('%s: dropping torn record at byte %d', path, offset)
+                        break
+                    last_seq = event['seq']
+                    offset += len(line)
+            if os.path.getsize(path) != offset:
+                with open(path, 'r+b') as f:
+                    f.truncate(offset)
+        return last_seq
+
+    def replay(self, after_seq=0):
+        """Yield events with seq > ``after_seq`` from disk, in order."""
+        segments = self.segments()
+        for i, first_seq in enumerate(segments):
+            if i + 1 < len(segments) and segments[i + 1] <= after_seq + 1:
+                continue
+            with open(self.segment_path(first_seq), 'rb') as f:
+                for line in f:
+                    event = decode(line)
+                    if event is None:
+                        break
+                    if event['seq'] > after_seq:
+                        yield event
+
+    def append(self, event):
+        """Queue an event for the next fsync and return its sequence number."""
+        with self.lock:
+            if self.closed or self.flusher is None:
+                raise RuntimeError('event log is not open')
+            if self.failed is not None:
+                raise EventLogFailed(f'event log failed: {self.failed!r}') from self.failed
+            seq = self.next_seq
+            self.next_seq += 1
+            self.buffer.append((seq, event))
+            self.lock.notify_all()
+        return seq
+
+    def wait_durable(self, seq, timeout=None):
+        with self.lock:
+            if not self.lock.wait_for(lambda: self.written_seq >= seq or self.failed is not None, timeout):
+                raise TimeoutError(f'event {seq} not durable after {timeout}s')
+            if self.written_seq < seq:
+                raise EventLogFailed(f'event {seq} not durable: {self.failed!r}') from self.failed
+
+    def flush_loop(self):
+        while True:
+            with self.lock:
+                self.lock.wait_for(lambda: self.buffer or self.closed)
+                if not self.buffer:
+                    return
+                batch, self.buffer = self.buffer, []
+            try:
+                self.file.write(b''.join(encode(seq, event) for seq, event in batch))
+                self.file.flush()
+                if self.fsync:
+                    os.fsync(self.file.fileno())
+                if self.file.tell() >= self.segment_bytes:
+                    self.file.close()
+                    self.file = open(self.segment_path(batch[-1][0] + 1), 'ab')
+            except Exception as e:
+                # After a failed fsync the page cache may have dropped the
+                # data, so retrying could acknowledge events that are lost;
+                # fail everything from here and let a restart recover().
+                logger.critical('event log %s failed at event %d: %r', self.directory, batch[0][0], e)
+                with self.lock:
+                    self.failed = e
+                    self.lock.notify_all()
+                return
+            with self.lock:
+                self.written_seq = batch[-1][0]
+                self.lock.notify_all()
+            for seq, event in batch:
+                self.durable.put(dict(event, seq=seq))
+
+    def drop_applied(self, seq):
+        """Delete segments whose events are all at or before ``seq``."""
+        segments = self.segments()
+        for first_seq, next_first_seq in zip(segments, segments[1:]):
+            if next_first_seq - 1 <= seq:
+                os.remove(self.segment_path(first_seq))
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.lock.notify_all()
+        if self.flusher is not None:
+            self.flusher.join()
+            self.file.close()
+            self.lock_file.close()
+
+
+class PendingEvents:
+    """Slot and session state of events logged but not yet in the database.
+
+    Entries remember the sequence number that set them and are dropped once
+    the writer has applied that far; a newer event for the same slot, ticket
+    or plate keeps its entry until it is applied in turn.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.applied_seq = 0
+        self.slots = {}    # (lot_id, key) -> (seq, ticket_id or None)
+        self.tickets = {}  # ticket_id -> (seq, park event, closed)
+        self.plates = {}   # plate -> (seq, ticket_id or None)
+
+    def add(self, seq, event, plate):
+        with self.lock:
+            if seq <= self.applied_seq:
+                return
+            key = (event['parkinglot_id'], (event['floor_id'], event['row_id'], event['slot_id']))
+            ticket_id = event['ticket_id']
+            if event['type'] == 'park':
+                self.slots[key] = (seq, ticket_id)
+                self.tickets[ticket_id] = (seq, event, False)
+                self.plates[plate] = (seq, ticket_id)
+            else:
+                self.slots[key] = (seq, None)
+                park = self.tickets.get(ticket_id, (None, None, None))[1]
+                self.tickets[ticket_id] = (seq, park, True)
+                self.plates[plate] = (seq, None)
+
+    def applied(self, seq):
+        with self.lock:
+            self.applied_seq = max(self.applied_seq, seq)
+            for entries in (self.slots, self.tickets, self.plates):
+                for k in [k for k, entry in entries.items() if entry[0] <= seq]:
+                    del entries[k]
+
+    def slot(self, lot_id, key):
+        """(True, ticket_id or None) if a pending event set the slot, else (False, None)."""
+        with self.lock:
+            entry = self.slots.get((lot_id, key))
+        return (False, None) if entry is None else (True, entry[1])
+
+    def ticket(self, ticket_id):
+        """(park event or None, closed) for a ticket with pending events, else None."""
+        with self.lock:
+            entry = self.tickets.get(ticket_id)
+        return None if entry is None else entry[1:]
+
+    def plate(self, plate):
+        """(True, open ticket_id or None) if a pending event touched the plate, else (False, None)."""
+        with self.lock:
+            entry = self.plates.get(plate)
+        return (False, None) if entry is None else (True, entry[1])
+
+
+def unavailable(exc):
+    return isinstance(exc, (ConnectionError, TimeoutError))
+
+
+class EventWriter:
+    """Applies durable events to the database in batches of up to ``batch_size``.
+
+    ``apply_batch(events)`` runs one transaction per call and raises on
+    failure. Errors for which ``transient(exc)`` is true (the database is
+    unreachable) are retried after ``retry_interval`` until they clear; any
+    other failure splits the batch into single events, and an event that
+    fails on its own is dead-lettered.
+    """
+
+    def __init__(self, log, apply_batch, pending=None, batch_size=500, retry_interval=1.0,
+                 transient=unavailable, submit_timeout=None):
+        self.log = log
+        self.apply_batch = apply_batch
+        self.pending = pending or PendingEvents()
+        self.batch_size = batch_size
+        self.retry_interval = retry_interval
+        self.transient = transient
+        self.submit_timeout = submit_timeout
+        self.checkpoint_path = os.path.join(log.directory, CHECKPOINT)
+        self.dead_letter_path = os.path.join(log.directory, DEAD_LETTER)
+        self.applied_seq = 0
+        self.progress = threading.Condition()
+        self.starting = threading.Lock()
+        self.stopping = False
+        self.thread = None
+
+    def read_checkpoint(self):
+        try:
+            with open(self.checkpoint_path) as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def write_checkpoint(self, seq):
+        tmp = self.checkpoint_path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(str(seq))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.checkpoint_path)
+
+    def recover(self):
+        """Apply events logged before a restart but never checkpointed."""
+        replayed = 0
+        batch = []
+        for event in self.log.replay(self.applied_seq):
+            batch.append(event)
+            if len(batch) >= self.batch_size:
+                self.apply(batch)
+                replayed += len(batch)
+                batch = []
+        if batch:
+            self.apply(batch)
+            replayed += len(batch)
+        if replayed:
+            logger.info('replayed %d events from %s', replayed, self.log.directory)
+        return replayed
+
+    def try_apply(self, batch):
+        """Apply a batch, waiting out transient errors; returns the error of any other failure."""
+        while True:
+            try:
+                self.apply_batch(batch)
+                return None
+            except Exception as e:
+                if not self.transient(e):
+                    return e
+                logger.warning('applying events %d-%d failed, retrying: %s', batch[0]['seq'], batch[-1]['seq'], e)
+                time.sleep(self.retry_interval)
+
+    def dead_letter(self, event, error):
+        with open(self.dead_letter_path, 'ab') as f:
+            f.write(encode(event['seq'], dict(event, error=repr(error))))
+            f.flush()
+            os.fsync(f.fileno())
+        logger.critical('event %d cannot be applied, moved to %s: %r', event['seq'], self.dead_letter_path, error)
+
+    def apply(self, batch):
+        error = self.try_apply(batch)
+        if error is not None:
+            logger.error('applying events %d-%d failed, applying them one at a time: %r',
+                         batch[0]['seq'], batch[-1]['seq'], error)
+            for event in batch:
+                error = self.try_apply([event])
+                if error is not None:
+                    self.dead_letter(event, error)
+        seq = batch[-1]['seq']
+        self.write_checkpoint(seq)
+        self.pending.applied(seq)
+        self.log.drop_applied(seq)
+        with self.progress:
+            self.applied_seq = seq
+            self.progress.notify_all()
+
+    def start(self):
+        """Open the log, replay what the last run left unapplied and start applying."""
+        if self.log.flusher is None:
+            self.log.open()
+        self.applied_seq = self.read_checkpoint()
+        self.recover()
+        self.thread = threading.Thread(target=self.run, name='event-writer', daemon=True)
+        self.thread.start()
+
+    def ensure_started(self):
+        """Start on first use; concurrent callers wait until recovery is done."""
+        with self.starting:
+            if self.thread is None:
+                self.start()
+
+    def run(self):
+        while True:
+            try:
+                event = self.log.durable.get(timeout=0.1)
+            except queue.Empty:
+                if self.stopping:
+                    return
+                continue
+            batch = [event]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.log.durable.get_nowait())
+                except queue.Empty:
+                    break
+            self.apply(batch)
+
+    def submit(self, event, plate):
+        """Log an event and return once it is durable; the database catches up later.
+
+        Raises EventLogFailed if the log can no longer write, or TimeoutError
+        after ``submit_timeout`` seconds. A timed-out event may still be
+        written and applied later.
+        """
+        seq = self.log.append(event)
+        self.pending.add(seq, event, plate)
+        self.log.wait_durable(seq, self.submit_timeout)
+        return seq
+
+    def sync(self, timeout=None):
+        """Wait until everything logged so far is in the database."""
+        target = self.log.next_seq - 1
+        with self.progress:
+            if not self.progress.wait_for(lambda: self.applied_seq >= target, timeout):
+                raise TimeoutError(f'event writer at {self.applied_seq}, waiting for {target}')
+
+    def stop(self):
+        self.log.close()
+        self.stopping = True
+        if self.thread is not None:
+            self.thread.join()
@@ -0,0 +1,139 @@
+"""Occupancy forecasting from parking session history.
+
+Each lot gets an hour-of-week profile: how many cars arrive and leave in each
+of the 168 hours of a week, averaged over the weeks of history seen. Profiles
+are built from per-hour counts of closed sessions, aggregated by the
+database, then updated in place as this process closes sessions and rebuilt
+every ``max_age`` seconds to pick up other workers' sessions. A forecast is
+just a walk over the next few profile hours starting from the current
+occupancy.
+"""
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+
+HOURS_PER_WEEK = 168
+HOUR = np.timedelta64(1, 'h')
+
+
+def hour_of_week(times):
+    """Monday 00:00 = 0 ... Sunday 23:00 = 167, for datetime64 values."""
+    hours = np.asarray(times, dtype='datetime64[h]').astype(np.int64)
+    # 1970-01-01 was a Thursday, three days after a Monday
+    return (hours + 3 * 24) % HOURS_PER_WEEK
+
+
+class LotProfile:
+    def __init__(self):
+        self.arrivals = np.zeros(HOURS_PER_WEEK)
+        self.departures = np.zeros(HOURS_PER_WEEK)
+        self.first_seen = None
+        self.last_seen = None
+
+    @classmethod
+    def from_counts(cls, arrivals, departures, first_seen, last_seen):
+        """Profile from ``{hour_of_week: count}`` of arrivals and departures."""
+        profile = cls()
+        for counts, totals in ((arrivals, profile.arrivals), (departures, profile.departures)):
+            for hour, count in counts.items():
+                totals[hour] += count
+        if first_seen is not None:
+            profile.first_seen = np.datetime64(first_seen, 's')
+            profile.last_seen = np.datetime64(last_seen, 's')
+        return profile
+
+    def record(self, start_time, end_time):
+        start = np.datetime64(start_time, 's')
+        end = np.datetime64(end_time, 's')
+        self.arrivals[hour_of_week(start)] += 1
+        self.departures[hour_of_week(end)] += 1
+        self.first_seen = start if self.first_seen is None else min(self.first_seen, start)
+        self.last_seen = end if self.last_seen is None else max(self.last_seen, end)
+
+    @property
+    def weeks(self):
+        """Weeks of history covered, at least one so rates are never inflated."""
+        if self.first_seen is None:
+            return 1.0
+        span = (self.last_seen - self.first_seen) / np.timedelta64(1, 'h')
+        return max(span / HOURS_PER_WEEK, 1.0)
+
+    def forecast(self, now, occupied, capacity, hours=24):
+        """Expected arrivals, departures and occupancy for each of the next ``hours``."""
+        start = np.datetime64(now, 'h')
+        slots = hour_of_week(start + np.arange(1, hours + 1) * HOUR)
+        arrivals = self.arrivals[slots] / self.weeks
+        departures = self.departures[slots] / self.weeks
+        # Occupancy is bounded by the lot, so apply the clip hour by hour
+        expected = np.empty(hours)
+        level = float(occupied)
+        for i in range(hours):
+            level = min(max(level + arrivals[i] - departures[i], 0.0), float(capacity))
+            expected[i] = level
+        return arrivals, departures, expected
+
+
+class ForecastModel:
+    """Per-app registry of LotProfiles, built lazily per lot.
+
+    ``loader(lot_id, offset)`` returns ``(arrivals, departures, first_seen,
+    last_seen)`` for the lot's closed sessions: ``{hour_of_week: count}`` of
+    start and end times shifted by ``offset`` (a timedelta), and the earliest
+    start and latest end. Profiles older than ``max_age`` seconds are rebuilt;
+    a session closed by this process while its lot is being rebuilt may be
+    missed until the next rebuild.
+    """
+
+    def __init__(self, loader, utc_offset_hours=0, max_age=900):
+        self.loader = loader
+        self.offset = timedelta(hours=utc_offset_hours)
+        self.max_age = max_age
+        self.profiles = {}
+        self.built_at = {}
+        self.lock = threading.Lock()
+
+    def profile(self, lot_id):
+        with self.lock:
+            profile = self.profiles.get(lot_id)
+            if profile is not None and self.built_at[lot_id] + self.max_age >= time.monotonic():
+                return profile
+        arrivals, departures, first_seen, last_seen = self.loader(lot_id, self.offset)
+        profile = LotProfile.from_counts(
+            arrivals, departures,
+            first_seen and first_seen + self.offset, last_seen and last_seen + self.offset
+        )
+        with self.lock:
+            self.profiles[lot_id] = profile
+            self.built_at[lot_id] = time.monotonic()
+        return profile
+
+    def record(self, lot_id, start_time, end_time):
+        """Fold a just-closed session into the lot's profile, if it is built."""
+        with self.lock:
+            profile = self.profiles.get(lot_id)
+            if profile is not None:
+                profile.record(start_time + self.offset, end_time + self.offset)
+
+    def forecast(self, lot_id, now, occupied, capacity, hours=24):
+        profile = self.profile(lot_id)
+        arrivals, departures, expected = profile.forecast(now + self.offset, occupied, capacity, hours)
+        current_hour = now.replace(minute=0, second=0, microsecond=0)
+        full_at = None
+        rows = []
+        for i in range(hours):
+            hour = (current_hour + timedelta(hours=i + 1)).isoformat()
+            if full_at is None and expected[i] >= capacity:
+                full_at = hour
+            rows.append({
+                'hour': hour,
+                'expected_arrivals': round(float(arrivals[i]), 2),
+                'expected_departures': round(float(departures[i]), 2),
+                'expected_occupied': round(float(expected[i]), 2)
+            })
+        return {
+            'weeks_of_history': round(profile.weeks, 2),
+            'full_at': full_at,
+            'hours': rows
+        }
@@ -0,0 +1,87 @@
+"""Per-request SQL statement and row budgets.
+
+Routes declare how many statements (and optionally rows) one request may
+use with ``@query_budget(statements=..., rows=...)``. When the guard is on,
+every statement executed while handling a request is counted; going over
+budget raises ``QueryBudgetExceeded`` in tests and logs a warning otherwise,
+so N+1 loads (e.g. walking ``Floor.rows``/``Row.slots``) show up early.
+
+The guard is on when ``TESTING`` or ``QUERY_BUDGET_DEBUG`` is set. Counts are
+also returned in the ``X-Query-Count`` and ``X-Query-Rows`` headers.
+"""
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(statements, rows=None, per_shard=False, scatter=0):
+    """Declare the SQL budget of a view function; None means no limit.
+
+    ``per_shard`` budgets are multiplied by the number of lot shards, for
+    views that query every shard. ``scatter`` statements are added once per
+    shard on top of ``statements``, for views that look a lot up on every
+    shard and then query only that lot's shard.
+    """
+    def decorator(f):
+        f.query_budget = {'statements': statements, 'rows': rows, 'per_shard': per_shard, 'scatter': scatter}
+        return f
+    return decorator
+
+
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'query_stats' in g:
+        g.query_stats['statements'] += 1
+        # DB-API rowcount: rows returned by a SELECT (psycopg2) or changed by DML
+        g.query_stats['rows'] += max(cursor.rowcount, 0)
+
+
+def init_query_budget(app):
+    app.config.setdefault('QUERY_BUDGET_DEBUG', False)
+    app.config.setdefault('QUERY_BUDGETS', {})  # {endpoint: {'statements': n, 'rows': n}} overrides
+    if not (app.config.get('TESTING') or app.config['QUERY_BUDGET_DEBUG']):
+        return
+
+    if not event.contains(Engine, 'after_cursor_execute', _count_statement):
+        event.listen(Engine, 'after_cursor_execute', _count_statement)
+
+    @app.before_request
+    def start_query_budget():
+        g.query_stats = {'statements': 0, 'rows': 0}
+
+    @app.after_request
+    def check_query_budget(response):
+        stats = g.pop('query_stats', None)
+        if stats is None:
+            return response
+        response.headers['X-Query-Count'] = str(stats['statements'])
+        response.headers['X-Query-Rows'] = str(stats['rows'])
+
+        view = app.view_functions.get(request.endpoint)
+        budget = app.config['QUERY_BUDGETS'].get(request.endpoint) or getattr(view, 'query_budget', None)
+        if budget is None:
+            return response
+
+        router = app.extensions.get('lot_router')
+        shards = len(router.shards()) if router else 1
+        limits = {
+            kind: budget[kind] * (shards if budget.get('per_shard') else 1)
+            for kind in ('statements', 'rows')
+            if budget.get(kind) is not None
+        }
+        if 'statements' in limits:
+            limits['statements'] += budget.get('scatter', 0) * shards
+        over = [
+            f"{kind} {stats[kind]} > {limit}"
+            for kind, limit in limits.items()
+            if stats[kind] > limit
+        ]
+        if over:
+            message = f"{request.method} {request.path} over query budget: {', '.join(over)}"
+            if app.config.get('TESTING'):
+                raise QueryBudgetExceeded(message)
+            app.logger.warning(message)
+        return response
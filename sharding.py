@@ -0,0 +1,92 @@
+"""Routing lot data to database shards by parkinglot_id.
+
+Every lot-keyed table (lots, floors, rows, slots, parking sessions) can live
+on a separate database bind per range of lot ids, so new garages are added
+on a new shard without moving existing ones::
+
+    SQLALCHEMY_BINDS = {'lots_b': 'postgresql://.../parking_lots_b'}
+    LOT_SHARDS = [(1, None), (1000, 'lots_b')]
+
+puts lots 1-999 on the default database and lots from 1000 up on
+``lots_b``. Users stay on the default database.
+
+``LotShardSession`` sends statements on lot tables (marked with
+``table.info['lot_shard']``) to the bind selected by ``on_shard`` for the
+current app context; everything else goes where Flask-SQLAlchemy would send
+it. Lot-scoped code selects the lot's shard first, and listings that span
+lots query each shard in turn. Pending changes are flushed to the shard
+selected at flush time, so code touching several lots flushes before it
+moves on to the next lot's shard.
+"""
+from bisect import bisect_right
+from contextlib import contextmanager
+
+import sqlalchemy as sa
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+
+
+class LotRouter:
+    """Maps lot ids to bind keys from ``[(first_lot_id, bind_key), ...]`` ranges."""
+
+    def __init__(self, ranges=()):
+        ranges = sorted(ranges or [(1, None)], key=lambda r: r[0])
+        self.starts = [start for start, _ in ranges]
+        self.keys = [key for _, key in ranges]
+
+    def shard_for(self, lot_id):
+        return self.keys[max(bisect_right(self.starts, lot_id) - 1, 0)]
+
+    def shards(self):
+        """Distinct bind keys holding lots, in lot id order."""
+        return list(dict.fromkeys(self.keys))
+
+
+@contextmanager
+def on_shard(bind_key):
+    """Send lot-table statements in this block to ``bind_key`` (None = default bind)."""
+    previous = g.get('lot_shard')
+    g.lot_shard = bind_key
+    try:
+        yield
+    finally:
+        g.lot_shard = previous
+
+
+def lot_tables(clause, mapper=None):
+    if mapper is not None:
+        yield sa.inspect(mapper).local_table
+    if isinstance(clause, sa.Table):
+        yield clause
+    elif isinstance(clause, sa.UpdateBase) and isinstance(clause.table, sa.Table):
+        yield clause.table
+    elif isinstance(clause, sa.Select):
+        yield from (f for f in clause.get_final_froms() if isinstance(f, sa.Table))
+
+
+class LotShardSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context():
+            shard = g.get('lot_shard')
+            if shard is not None and any(t.info.get('lot_shard') for t in lot_tables(clause, mapper)):
+                return self._db.engines[shard]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def add_lot_tables(metadata, tables):
+    """Copy the lot tables into a shard bind's metadata, so create_all/drop_all cover it.
+
+    Foreign keys to tables outside the shard (parking_sessions.user_id ->
+    users) cannot cross databases, so they are left out.
+    """
+    names = {table.name for table in tables}
+    for table in tables:
+        if table.name in metadata.tables:
+            continue
+        copy = table.to_metadata(metadata)
+        for constraint in list(copy.foreign_key_constraints):
+            if constraint.elements[0].target_fullname.split('.')[0] not in names:
+                copy.constraints.discard(constraint)
+                for element in constraint.elements:
+                    element.parent.foreign_keys.discard(element)
+                    copy.foreign_keys.discard(element)
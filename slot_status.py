@@ -0,0 +1,160 @@
+"""Compact slot status for display boards.
+
+A lot is described once by a static layout document listing its slots in a
+fixed order (floor, row, slot). After that a client only needs one bit per
+slot: ``LotStatus.packed()`` is the occupied flags packed eight to a byte,
+and ``LotStatus.delta_since(version)`` lists just the slot indices that
+flipped since a version the client already has.
+
+Versions look like ``<epoch>.<counter>``. The epoch is new for every load
+of a layout, so a client holding a version from another process or an older
+layout gets a full bitset instead of a wrong delta. Periodic reloads of an
+unchanged layout keep the epoch and record the slots that flipped in the
+database as ordinary changes.
+"""
+import hashlib
+import secrets
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+HISTORY = 4096
+
+
+def layout_version(keys):
+    """Stable id of a slot ordering; changes whenever slots are added or removed."""
+    return hashlib.sha1(repr(list(keys)).encode()).hexdigest()[:16]
+
+
+class LotStatus:
+    """Occupied bits of one lot. Gates and pollers share it, so all access
+    goes through ``lock``; ``snapshot`` reads the body and its version
+    together so a client never gets a version ahead of its bits."""
+
+    def __init__(self, keys, occupied, history=HISTORY):
+        self.keys = list(keys)
+        self.index = {key: i for i, key in enumerate(self.keys)}
+        self.bits = np.array(occupied, dtype=bool)
+        self.layout_version = layout_version(self.keys)
+        self.epoch = secrets.token_hex(4)
+        self.counter = 0
+        self.changes = deque(maxlen=history)
+        self.built_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    @property
+    def version(self):
+        with self.lock:
+            return f'{self.epoch}.{self.counter}'
+
+    def set(self, key, occupied):
+        """Record a slot change; returns False if the slot is not in this layout."""
+        i = self.index.get(key)
+        if i is None:
+            return False
+        with self.lock:
+            if self.bits[i] != occupied:
+                self.bits[i] = occupied
+                self.counter += 1
+                self.changes.append((self.counter, i))
+        return True
+
+    def refresh(self, occupied):
+        """Take freshly loaded flags for the same layout, recording flips as changes."""
+        occupied = np.array(occupied, dtype=bool)
+        with self.lock:
+            for i in np.flatnonzero(occupied != self.bits):
+                self.counter += 1
+                self.changes.append((self.counter, int(i)))
+            self.bits = occupied
+            self.built_at = time.monotonic()
+
+    def snapshot(self, since=None):
+        """``(version, encoding, body)`` read atomically: a delta against
+        ``since`` if there is one smaller than the full bitset, else the bitset."""
+        with self.lock:
+            encoding, body = 'full', self._packed()
+            if since:
+                delta = self._delta_since(since)
+                if delta is not None and len(delta) < len(body):
+                    encoding, body = 'delta', delta
+            return f'{self.epoch}.{self.counter}', encoding, body
+
+    def packed(self):
+        """One bit per slot in layout order, most significant bit first."""
+        with self.lock:
+            return self._packed()
+
+    def _packed(self):
+        return np.packbits(self.bits).tobytes()
+
+    def delta_since(self, version):
+        """Little-endian uint32 indices of slots that flipped since ``version``.
+
+        Returns None when a delta cannot be built (unknown epoch, or the
+        change history no longer reaches back that far).
+        """
+        with self.lock:
+            return self._delta_since(version)
+
+    def _delta_since(self, version):
+        epoch, _, counter = (version or '').partition('.')
+        if epoch != self.epoch or not counter.isdigit():
+            return None
+        since = int(counter)
+        if since > self.counter:
+            return None
+        if since == self.counter:
+            return b''
+        if not self.changes or self.changes[0][0] > since + 1:
+            return None
+        flipped = np.array([i for c, i in self.changes if c > since], dtype=np.uint32)
+        # A slot that flipped twice is back where the client has it
+        indices, counts = np.unique(flipped, return_counts=True)
+        return indices[counts % 2 == 1].astype('<u4').tobytes()
+
+
+class StatusBoard:
+    """Per-app registry of LotStatus, loaded lazily.
+
+    ``loader(lot_id)`` returns ``[(floor_id, row_id, slot_id, status), ...]``
+    ordered by floor, row and slot. Entries older than ``ttl`` seconds are
+    reloaded so other workers' changes show up; clients polling with deltas
+    see those as flipped slots rather than a new epoch.
+    """
+
+    def __init__(self, loader, ttl=5):
+        self.loader = loader
+        self.ttl = ttl
+        self.lots = {}
+        self.lock = threading.Lock()
+
+    def lot(self, lot_id):
+        with self.lock:
+            status = self.lots.get(lot_id)
+            if status is not None and status.built_at + self.ttl >= time.monotonic():
+                return status
+        slots = self.loader(lot_id)
+        keys, occupied = [s[:3] for s in slots], [s[3] == 1 for s in slots]
+        with self.lock:
+            status = self.lots.get(lot_id)
+            if status is not None and status.layout_version == layout_version(keys):
+                status.refresh(occupied)
+            else:
+                status = self.lots[lot_id] = LotStatus(keys, occupied)
+        return status
+
+    def set(self, lot_id, key, occupied):
+        with self.lock:
+            status = self.lots.get(lot_id)
+            if status is not None and not status.set(key, occupied):
+                del self.lots[lot_id]
+
+    def invalidate(self, lot_id=None):
+        with self.lock:
+            if lot_id is None:
+                self.lots.clear()
+            else:
+                self.lots.pop(lot_id, None)
@@ -0,0 +1,339 @@
+"""Deterministic synthetic data for scale testing.
+
+Builds N lots x floors x rows x slots, users and historical (closed)
+parking sessions with daily and weekly arrival peaks, and bulk-loads them.
+The same seed always produces the same rows: every lot draws from its own
+random stream, so output does not depend on chunking or load order.
+
+On PostgreSQL rows are streamed with COPY; other databases fall back to
+chunked executemany inserts.
+
+    python synthetic_data.py --lots 1000 --floors 4 --rows 25 --slots 10 \\
+        --users 10000 --sessions-per-lot 10000 --reset
+
+loads 1k lots, 1M slots and 10M sessions into the configured database
+(or ``--database-url``). Each lot's rows go to its ``LOT_SHARDS`` shard.
+"""
+import argparse
+import csv
+import heapq
+import io
+import string
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+CITIES = ['Delhi', 'Noida', 'Gurugram', 'Mumbai', 'Pune', 'Bengaluru', 'Hyderabad', 'Chennai']
+CHARGES = [
+    ('Rs 20 per hour', 'Rs 10 per hour'),
+    ('20 per hour max 100', 'Rs 10 per hour max 100'),
+    ('20 up to 6 hours 30 for 12 hours', '10 up to 6 hours 15 up to 12'),
+    ('20 rs for first hour 10 for the next subsequent hours', 'Not applicable.'),
+    ('Free parking.', 'Free parking.'),
+]
+STATE_CODES = ['DL', 'UP', 'HR', 'MH', 'KA', 'TN', 'TS']
+
+# Share of the day's arrivals in each hour: morning and evening peaks
+HOURLY_ARRIVALS = np.array([
+    0.2, 0.1, 0.1, 0.1, 0.2, 0.5, 1.5, 3.5, 6.0, 7.0, 6.0, 5.0,
+    5.0, 5.0, 4.5, 4.5, 5.0, 6.5, 7.5, 6.5, 4.5, 3.0, 1.5, 0.7
+])
+HOURLY_ARRIVALS /= HOURLY_ARRIVALS.sum()
+# Relative traffic Monday..Sunday
+WEEKDAY_TRAFFIC = np.array([1.0, 1.0, 1.0, 1.0, 1.1, 0.8, 0.6])
+
+TWO_WHEELER_SHARE = 0.15
+CHUNK_SIZE = 100000
+
+
+def _rng(seed, *stream):
+    return np.random.default_rng([seed, *stream])
+
+
+def lot_rows(seed, lot_ids, floors, rows, slots):
+    rng = _rng(seed, 2)
+    capacity = floors * rows * slots
+    cities = rng.integers(0, len(CITIES), len(lot_ids))
+    charges = rng.integers(0, len(CHARGES), len(lot_ids))
+    for lot_id, city, charge in zip(lot_ids, cities.tolist(), charges.tolist()):
+        car_charge, two_wheeler_charge = CHARGES[charge]
+        yield (
+            lot_id, f'Synthetic Lot {lot_id:05d}', CITIES[city], f'Landmark {lot_id}',
+            f'{lot_id} Synthetic Road, {CITIES[city]}', capacity, capacity,
+            car_charge, two_wheeler_charge
+        )
+
+
+def layout_rows(lot_ids, floors, rows, slots):
+    """Return (floor rows, row rows, slot rows) generators for every lot."""
+    def floor_rows():
+        for lot_id in lot_ids:
+            for floor_id in range(1, floors + 1):
+                yield lot_id, floor_id, f'Floor {floor_id}'
+
+    def row_rows():
+        for lot_id in lot_ids:
+            for floor_id in range(1, floors + 1):
+                for row_id in range(1, rows + 1):
+                    yield lot_id, floor_id, row_id, f'Row {row_id}'
+
+    def slot_rows():
+        for lot_id in lot_ids:
+            for floor_id in range(1, floors + 1):
+                for row_id in range(1, rows + 1):
+                    for slot_id in range(1, slots + 1):
+                        yield lot_id, floor_id, row_id, slot_id, f'{floor_id}-{row_id}-{slot_id}', 0
+
+    return floor_rows(), row_rows(), slot_rows()
+
+
+def user_rows(start_user_id, count):
+    # Emails and phone numbers derive from the id so they are unique
+    for user_id in range(start_user_id, start_user_id + count):
+        yield (
+            user_id, f'Synthetic User {user_id}', f'synthetic{user_id}@example.com',
+            'password', str(6000000000 + user_id), None
+        )
+
+
+def assign_slots(starts, stays, capacity, picks):
+    """Give every stay a slot that is free for all of it.
+
+    Arrivals are walked in time order: slots whose car has left go back to
+    the free list and the arrival takes the free slot chosen by its ``picks``
+    value (uniform in [0, 1)). An arrival at a full lot waits for the first
+    slot to free up. Returns (start seconds, slot indexes), both arrays.
+    """
+    starts = starts.tolist()
+    stays = stays.tolist()
+    slot_index = np.empty(len(starts), dtype=np.int64)
+    free = list(range(capacity))
+    leaving = []  # heap of (end second, slot)
+    for i in sorted(range(len(starts)), key=starts.__getitem__):
+        while leaving and leaving[0][0] <= starts[i]:
+            free.append(heapq.heappop(leaving)[1])
+        if free:
+            n = int(picks[i] * len(free))
+            free[n], free[-1] = free[-1], free[n]
+            slot = free.pop()
+        else:
+            starts[i], slot = heapq.heappop(leaving)
+        slot_index[i] = slot
+        heapq.heappush(leaving, (starts[i] + stays[i], slot))
+    return np.array(starts, dtype=np.int64), slot_index
+
+
+def session_arrays(seed, lot_id, count, floors, rows, slots, user_ids, start, days):
+    """Vectorized session history for one lot, as a dict of NumPy arrays."""
+    rng = _rng(seed, 0, lot_id)
+    first_weekday = start.weekday()
+    day_weights = WEEKDAY_TRAFFIC[(np.arange(days) + first_weekday) % 7]
+    day = rng.choice(days, size=count, p=day_weights / day_weights.sum())
+    hour = rng.choice(24, size=count, p=HOURLY_ARRIVALS)
+    second = rng.integers(0, 3600, size=count)
+    start_times = (
+        np.datetime64(start, 's')
+        + (day * 86400 + hour * 3600 + second).astype('timedelta64[s]')
+    )
+    # Most stays last an hour or two; a few run overnight
+    stay_seconds = np.clip(rng.lognormal(np.log(1.5 * 3600), 0.9, size=count), 180, 72 * 3600)
+
+    start_seconds, slot_index = assign_slots(
+        start_times.astype(np.int64), stay_seconds.astype(np.int64),
+        floors * rows * slots, rng.random(count)
+    )
+    start_times = start_seconds.astype('datetime64[s]')
+    end_times = start_times + stay_seconds.astype('timedelta64[s]')
+    floor_index, rest = np.divmod(slot_index, rows * slots)
+    row_index, slot_offset = np.divmod(rest, slots)
+
+    return {
+        'start_time': start_times,
+        'end_time': end_times,
+        'floor_id': floor_index + 1,
+        'row_id': row_index + 1,
+        'slot_id': slot_offset + 1,
+        'user_id': rng.choice(user_ids, size=count),
+        'two_wheeler': rng.random(count) < TWO_WHEELER_SHARE,
+        'state': rng.integers(0, len(STATE_CODES), size=count),
+        'district': rng.integers(1, 100, size=count),
+        'series': rng.integers(0, 26 * 26, size=count),
+        'number': rng.integers(1, 10000, size=count),
+    }
+
+
+def session_rows(seed, lot_id, count, floors, rows, slots, user_ids, start, days):
+    arrays = session_arrays(seed, lot_id, count, floors, rows, slots, user_ids, start, days)
+    letters = string.ascii_uppercase
+    columns = zip(
+        arrays['floor_id'].tolist(), arrays['row_id'].tolist(), arrays['slot_id'].tolist(),
+        arrays['user_id'].tolist(), arrays['two_wheeler'].tolist(),
+        arrays['start_time'].tolist(), arrays['end_time'].tolist(),
+        arrays['state'].tolist(), arrays['district'].tolist(),
+        arrays['series'].tolist(), arrays['number'].tolist()
+    )
+    for n, (floor_id, row_id, slot_id, user_id, two_wheeler, start_time, end_time,
+            state, district, series, number) in enumerate(columns):
+        plate = (
+            f'{STATE_CODES[state]}{district:02d}'
+            f'{letters[series // 26]}{letters[series % 26]}{number:04d}'
+        )
+        yield (
+            f'SYN-{lot_id}-{n}', lot_id, floor_id, row_id, slot_id, plate, user_id,
+            'two_wheeler' if two_wheeler else 'car', start_time, end_time
+        )
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def bulk_insert(engine, table, columns, rows, chunk_size=CHUNK_SIZE):
+    """Load rows (tuples in ``columns`` order); returns the number loaded."""
+    loaded = 0
+    if engine.dialect.name == 'postgresql':
+        table_name = engine.dialect.identifier_preparer.format_table(table)
+        copy_sql = f'COPY {table_name} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)'
+        connection = engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            for chunk in _chunks(rows, chunk_size):
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(chunk)
+                buffer.seek(0)
+                cursor.copy_expert(copy_sql, buffer)
+                loaded += len(chunk)
+            connection.commit()
+        finally:
+            connection.close()
+        return loaded
+
+    with engine.begin() as conn:
+        for chunk in _chunks(rows, chunk_size):
+            conn.execute(table.insert(), [dict(zip(columns, row)) for row in chunk])
+            loaded += len(chunk)
+    return loaded
+
+
+def generate(engine, lots=10, floors=4, rows=25, slots=10, users=1000, sessions_per_lot=1000,
+             days=90, seed=42, start_lot_id=1, start_user_id=1, end=None, log=None, lot_engine=None):
+    """Generate and load a full dataset; returns row counts per table.
+
+    Users go to ``engine``. Lot, floor, row, slot and session rows go to
+    ``lot_engine(lot_id)`` (default ``engine``), so each lot lands on its shard.
+    """
+    # Imported here so the generators above can be used without the app
+    from app import ParkingLotDetails, Floor, Row, Slot, User, ParkingSession
+
+    end = end or datetime(2026, 1, 1)
+    start = end - timedelta(days=days)
+    lot_ids = list(range(start_lot_id, start_lot_id + lots))
+    user_ids = np.arange(start_user_id, start_user_id + users)
+    counts = dict.fromkeys(['lots', 'floors', 'rows', 'slots', 'users', 'sessions'], 0)
+
+    # Lots grouped by the engine holding them, in id order
+    groups = {}
+    for lot_id in lot_ids:
+        groups.setdefault(lot_engine(lot_id) if lot_engine else engine, []).append(lot_id)
+    # One draw over all lots, so sharding does not change the generated rows
+    lot_details = list(lot_rows(seed, lot_ids, floors, rows, slots))
+
+    def load(target, name, model, columns, table_rows):
+        began = time.perf_counter()
+        loaded = bulk_insert(target, model.__table__, columns, table_rows)
+        counts[name] += loaded
+        if log:
+            elapsed = time.perf_counter() - began
+            log(f'{name:<10} {loaded:>12,} rows {elapsed:>8.1f}s {loaded / max(elapsed, 1e-9):>12,.0f} rows/s'
+                f'  {target.url.database}')
+
+    for target, group in groups.items():
+        members = set(group)
+        load(target, 'lots', ParkingLotDetails, [
+            'parkinglot_id', 'parking_name', 'city', 'landmark', 'address',
+            'car_capacity', 'available_car_slots', 'car_parking_charge', 'two_wheeler_parking_charge'
+        ], (row for row in lot_details if row[0] in members))
+        floor_rows, row_rows, slot_rows = layout_rows(group, floors, rows, slots)
+        load(target, 'floors', Floor, ['parkinglot_id', 'floor_id', 'floor_name'], floor_rows)
+        load(target, 'rows', Row, ['parkinglot_id', 'floor_id', 'row_id', 'row_name'], row_rows)
+        load(target, 'slots', Slot, ['parkinglot_id', 'floor_id', 'row_id', 'slot_id', 'slot_name', 'status'], slot_rows)
+    load(engine, 'users', User, [
+        'user_id', 'user_name', 'user_email', 'user_password', 'user_phone_no', 'user_address'
+    ], user_rows(start_user_id, users))
+
+    def all_sessions(group):
+        for lot_id in group:
+            yield from session_rows(seed, lot_id, sessions_per_lot, floors, rows, slots, user_ids, start, days)
+
+    for target, group in groups.items():
+        load(target, 'sessions', ParkingSession, [
+            'ticket_id', 'parkinglot_id', 'floor_id', 'row_id', 'slot_id', 'vehicle_reg_no',
+            'user_id', 'vehicle_type', 'start_time', 'end_time'
+        ], all_sessions(group))
+
+    # Explicit ids were loaded, so move the id sequences past them
+    sequences = {target: [('parkinglots_details', 'parkinglot_id')] for target in groups}
+    sequences.setdefault(engine, []).append(('users', 'user_id'))
+    for target, tables in sequences.items():
+        if target.dialect.name != 'postgresql':
+            continue
+        with target.begin() as conn:
+            for table, column in tables:
+                conn.exec_driver_sql(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', '{column}'), "
+                    f"(SELECT MAX({column}) FROM {table}))"
+                )
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lots', type=int, default=10)
+    parser.add_argument('--floors', type=int, default=4)
+    parser.add_argument('--rows', type=int, default=25)
+    parser.add_argument('--slots', type=int, default=10)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--sessions-per-lot', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=90, help='days of session history')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--start-lot-id', type=int, default=1)
+    parser.add_argument('--start-user-id', type=int, default=1)
+    parser.add_argument('--database-url', help='defaults to the database configured in create_app')
+    parser.add_argument('--reset', action='store_true', help='drop and recreate all tables first')
+    args = parser.parse_args()
+
+    from app import create_app, db
+
+    if args.database_url:
+        app = create_app(test_config={
+            'SQLALCHEMY_DATABASE_URI': args.database_url,
+            'SQLALCHEMY_TRACK_MODIFICATIONS': False
+        })
+    else:
+        app = create_app()
+
+    with app.app_context():
+        if args.reset:
+            db.drop_all()
+            db.create_all()
+        router = app.extensions['lot_router']
+        began = time.perf_counter()
+        counts = generate(
+            db.engine, lots=args.lots, floors=args.floors, rows=args.rows, slots=args.slots,
+            users=args.users, sessions_per_lot=args.sessions_per_lot, days=args.days,
+            seed=args.seed, start_lot_id=args.start_lot_id, start_user_id=args.start_user_id,
+            log=print, lot_engine=lambda lot_id: db.engines[router.shard_for(lot_id)]
+        )
+        print(f'loaded {sum(counts.values()):,} rows in {time.perf_counter() - began:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
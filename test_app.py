@@ -5,9 +5,21 @@ import jwt
 from datetime import datetime, timedelta
 from app import create_app, db
 from app import ParkingLotDetails, Floor, Row, Slot, User, ParkingSession
+from allocation import LotAllocator, SlotAllocator, DEFAULT_POLICY, spread_floors, two_wheeler_reserved
+from billing import parse_tariff, bill_sessions
+from caches import PlateCache, StructureCache
+from query_budget import QueryBudgetExceeded
+from forecast import hour_of_week
+from slot_status import LotStatus, StatusBoard
+from event_log import EventLog, EventLogCorrupt, EventLogLocked, EventWriter, PendingEvents, decode
+from sharding import LotRouter, on_shard
+from sqlalchemy import func, select
+import synthetic_data
+import numpy as np
 import json
 import urllib.parse
 import time
+import threading
 
 # Set testing mode environment variable
 os.environ['TESTING'] = 'True'
@@ -15,21 +27,21 @@ os.environ['TESTING'] = 'True'
 # JWT Secret for testing
 JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'your-secret-key-here')
 
-# Create a test client fixture
-@pytest.fixture
-def client():
+def database_uri(DB_NAME="parking_test"):
     # Get database connection details from environment variables or use defaults
     DB_USER = "postgres" 
     DB_PASSWORD = urllib.parse.quote_plus("root")
     DB_HOST = "localhost"
     DB_PORT = 5432
-    DB_NAME = "parking_test"
-    
+    return f'postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
+
+def build_test_app(extra_config=None):
     # Configure test app
     app = create_app(test_config={
         'TESTING': True,
-        'SQLALCHEMY_DATABASE_URI': f'postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}',
-        'SQLALCHEMY_TRACK_MODIFICATIONS': False
+        'SQLALCHEMY_DATABASE_URI': database_uri(),
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        **(extra_config or {})
     })
 
     # Prepare test database
@@ -93,15 +105,59 @@ def client():
         # Add all test data to session and commit
         db.session.add_all([test_parking, test_floor, test_row, test_slot, test_user])
         db.session.commit()
+    return app
+
+def drop_test_app(app):
+    with app.app_context():
+        db.drop_all()
+        db.session.remove()
+
+# Create a test client fixture
+@pytest.fixture
+def client():
+    app = build_test_app()
 
     # Yield test client
     with app.test_client() as client:
         yield client
 
     # Teardown - drop all tables after tests
+    drop_test_app(app)
+
+# Test client acknowledging gates from a write-ahead event log
+@pytest.fixture
+def logged_client(tmp_path):
+    app = build_test_app({'EVENT_LOG_DIR': str(tmp_path / 'events')})
+    with app.test_client() as client:
+        yield client
+    app.extensions['event_writer'].stop()
+    drop_test_app(app)
+
+# Test client with lots 100+ and 200+ on two more databases
+SHARDS = ['shard_b', 'shard_c']
+
+@pytest.fixture
+def sharded_client():
+    app = build_test_app({
+        'SQLALCHEMY_BINDS': {key: database_uri(f'parking_test_{key}') for key in SHARDS},
+        'LOT_SHARDS': [(1, None), (100, 'shard_b'), (200, 'shard_c')]
+    })
     with app.app_context():
-        db.drop_all()
-        db.session.remove()
+        for lot_id in (100, 200):
+            with on_shard(app.extensions['lot_router'].shard_for(lot_id)):
+                db.session.add(ParkingLotDetails(parkinglot_id=lot_id, parking_name=f"Lot {lot_id}"))
+                db.session.add(Floor(parkinglot_id=lot_id, floor_id=1, floor_name="Ground Floor"))
+                db.session.add(Row(parkinglot_id=lot_id, floor_id=1, row_id=1, row_name="A"))
+                db.session.add(Slot(parkinglot_id=lot_id, floor_id=1, row_id=1, slot_id=1, slot_name="A1", status=0))
+                db.session.commit()
+
+    with app.test_client() as client:
+        yield client
+
+    drop_test_app(app)
+    # The shared db keeps a metadata per bind it has seen; later apps lack these binds
+    for key in SHARDS:
+        del db.metadatas[key]
 
 # Helper function to generate JWT token for testing protected routes
 def get_auth_token(user_id=1):
@@ -225,6 +281,219 @@ def test_parking_lot_structure_with_token(client):
     assert len(data[0]['rows']) == 1
     assert len(data[0]['rows'][0]['slots']) == 1
 
+def test_parking_lot_structure_cache_patches_slot(client):
+    """Test park/unpark patch the cached lot structure instead of rebuilding it"""
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    response = client.get('/parking_lot_structure?parkinglot_id=1', headers=headers)
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+
+    client.post('/park_car', json={
+        "parking_lot_name": "Test Parking",
+        "vehicle_reg_no": "ABC123"
+    }, headers=headers)
+
+    response = client.get('/parking_lot_structure?parkinglot_id=1', headers=headers)
+    slot = json.loads(response.data)[0]['rows'][0]['slots'][0]
+    assert slot['status'] == 1
+    assert slot['vehicle_reg_no'] == "ABC123"
+    assert response.headers['ETag'] != etag
+
+    stats = json.loads(client.get('/parking_lot_structure/cache_stats', headers=headers).data)
+    assert stats['misses'] == 1
+    assert stats['hits'] == 1
+    assert stats['patches'] == 1
+
+def test_parking_lot_structure_not_modified(client):
+    """Test clients holding the current version get a 304"""
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    response = client.get('/parking_lot_structure?parkinglot_id=1', headers=headers)
+    headers['If-None-Match'] = response.headers['ETag']
+    response = client.get('/parking_lot_structure?parkinglot_id=1', headers=headers)
+    assert response.status_code == 304
+
+def test_parking_lot_structure_etag_is_per_process(client):
+    """Test a restarted or different worker never answers an old ETag with 304"""
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    response = client.get('/parking_lot_structure?parkinglot_id=1', headers=headers)
+    epoch = client.application.extensions['structure_cache'].epoch
+    assert response.headers['ETag'] == f'"{epoch}-1-1"'
+    assert StructureCache(lambda lot_ids: {}).epoch != epoch
+
+def test_structure_cache_lru_eviction():
+    """Test least recently used lots are evicted past the byte budget"""
+    def builder(lot_ids):
+        return {lot_id: [{'floor_id': 1, 'floor_name': 'G', 'rows': [
+            {'row_id': 1, 'row_name': 'A', 'slots': [
+                {'slot_id': 1, 'slot_name': 'A1', 'status': 0, 'vehicle_reg_no': None, 'ticket_id': None}
+            ]}
+        ]}] for lot_id in lot_ids}
+    cache = StructureCache(builder)
+    _, payload = cache.payload(1)
+    # The slot dicts kept for patching count towards the budget, not just the JSON
+    lot_bytes = cache.stats()['bytes']
+    assert lot_bytes > 2 * len(payload)
+    cache = StructureCache(builder, max_bytes=lot_bytes * 2)
+    cache.payload(1)
+    cache.payload(2)
+    cache.payload(1)
+    cache.payload(3)
+    assert list(cache.entries) == [1, 3]
+    assert cache.stats()['evictions'] == 1
+
+    version = cache.update_slot(1, (1, 1, 1), status=1)
+    assert cache.payload(1) == (version, payload.replace(b'"status":0', b'"status":1'))
+
+def test_structure_cache_replays_changes_made_during_build():
+    """Test a slot change committed while a lot is being built is not lost"""
+    def builder(lot_ids):
+        # Read before the concurrent park below committed
+        floors = [{'floor_id': 1, 'floor_name': 'G', 'rows': [
+            {'row_id': 1, 'row_name': 'A', 'slots': [
+                {'slot_id': 1, 'slot_name': 'A1', 'status': 0, 'vehicle_reg_no': None, 'ticket_id': None}
+            ]}
+        ]}]
+        builds.append(lot_ids)
+        if len(builds) == 1:
+            cache.update_slot(1, (1, 1, 1), status=1, vehicle_reg_no='KA01', ticket_id='TKT-1')
+        return {1: floors}
+    builds = []
+    cache = StructureCache(builder)
+    version, payload = cache.payload(1)
+    assert b'"status":1' in payload and b'"KA01"' in payload
+    assert version == cache.version(1) == 2
+
+    cache.invalidate(1)
+    builds.clear()
+    def invalidating_builder(lot_ids):
+        builds.append(lot_ids)
+        if len(builds) == 1:
+            cache.invalidate(1)
+        return {1: []}
+    cache.builder = invalidating_builder
+    assert cache.payload(1)[1] == b'[]'
+    assert builds == [[1], [1]]
+
+def test_parking_lot_structure_all_lots_bulk_load(client):
+    """Test the all-lots structure loads every cold lot in three queries, not three per lot"""
+    with client.application.app_context():
+        for lot_id in (2, 3):
+            db.session.add(ParkingLotDetails(parkinglot_id=lot_id, parking_name=f"Lot {lot_id}"))
+            db.session.add(Floor(parkinglot_id=lot_id, floor_id=1, floor_name=f"Lot {lot_id} Ground"))
+            db.session.add(Row(parkinglot_id=lot_id, floor_id=1, row_id=1, row_name="A"))
+            db.session.add(Slot(parkinglot_id=lot_id, floor_id=1, row_id=1, slot_id=1, slot_name="A1", status=0))
+        db.session.commit()
+    add_slots(client, [(2, 1, 1)])
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    response = client.get('/parking_lot_structure', headers=headers)
+    assert response.status_code == 200
+    assert response.headers['X-Query-Count'] == '4'
+    data = json.loads(response.data)
+    assert [floor['floor_name'] for floor in data] == ["Ground Floor", "Floor 2", "Lot 2 Ground", "Lot 3 Ground"]
+
+    # Per-lot reads now come from the cache
+    response = client.get('/parking_lot_structure?parkinglot_id=3', headers=headers)
+    assert response.headers['X-Query-Count'] == '0'
+    assert json.loads(response.data)[0]['rows'][0]['slots'][0]['slot_name'] == "A1"
+
+def test_parking_lot_layout(client):
+    """Test the static layout lists slots in bit order without live fields"""
+    add_slots(client, [(1, 1, 2), (2, 1, 1)])
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    response = client.get('/parkinglots/1/layout', headers=headers)
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['slot_count'] == 3
+    assert data['floors'][0]['rows'][0]['slots'] == [[1, "A1"], [2, "1-1-2"]]
+    assert response.headers['ETag'] == f'"{data["layout_version"]}"'
+
+    headers['If-None-Match'] = response.headers['ETag']
+    assert client.get('/parkinglots/1/layout', headers=headers).status_code == 304
+    assert client.get('/parkinglots/99/layout', headers=headers).status_code == 404
+
+def test_parking_lot_status_bitset_and_delta(client):
+    """Test /status sends a packed bitset, then only the flipped slots"""
+    add_slots(client, [(1, 1, slot_id) for slot_id in range(2, 41)])
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    response = client.get('/parkinglots/1/status', headers=headers)
+    assert response.status_code == 200
+    assert response.headers['X-Status-Encoding'] == 'full'
+    assert response.headers['X-Slot-Count'] == '40'
+    assert response.data == bytes(5)
+    version = response.headers['X-Lot-Version']
+
+    client.post('/park_car', json={
+        "parking_lot_name": "Test Parking",
+        "vehicle_reg_no": "ABC123"
+    }, headers=headers)
+
+    response = client.get(f'/parkinglots/1/status?since={version}', headers=headers)
+    assert response.headers['X-Status-Encoding'] == 'delta'
+    assert response.data == (0).to_bytes(4, 'little')
+    assert response.headers['X-Lot-Version'] != version
+
+    response = client.get('/parkinglots/1/status?since=stale.0', headers=headers)
+    assert response.headers['X-Status-Encoding'] == 'full'
+    assert response.data == bytes([0b10000000, 0, 0, 0, 0])
+    assert client.get('/parkinglots/99/status', headers=headers).status_code == 404
+
+def test_lot_status_delta():
+    """Test deltas cancel out double flips and give up past the history"""
+    status = LotStatus([(1, 1, i) for i in range(10)], [False] * 10, history=3)
+    start = status.version
+    status.set((1, 1, 3), True)
+    status.set((1, 1, 9), True)
+    status.set((1, 1, 3), False)
+    assert status.delta_since(start) == (9).to_bytes(4, 'little')
+    assert status.delta_since(status.version) == b''
+    assert status.packed() == bytes([0b00000000, 0b01000000])
+
+    status.set((1, 1, 0), True)
+    assert status.delta_since(start) is None
+    assert status.set((2, 1, 1), True) is False
+
+def test_lot_status_snapshot_is_atomic():
+    """Test a flip landing while /status reads the body is not claimed by its version"""
+    status = LotStatus([(1, 1, i) for i in range(10)], [False] * 10)
+    read_body = status._packed
+    flippers = []
+    def packed_then_flip():
+        body = read_body()
+        flipper = threading.Thread(target=status.set, args=((1, 1, 3), True))
+        flipper.start()
+        flipper.join(0.05)  # waits for the snapshot to finish
+        flippers.append(flipper)
+        return body
+    status._packed = packed_then_flip
+    version, encoding, body = status.snapshot()
+    flippers[0].join()
+    assert (encoding, body) == ('full', bytes(2))
+    assert version.endswith('.0')
+    assert status.delta_since(version) == (3).to_bytes(4, 'little')
+
+def test_status_board_reload_keeps_epoch():
+    """Test a TTL reload of an unchanged layout turns database changes into a delta"""
+    rows = [(1, 1, i, 0) for i in range(10)]
+    board = StatusBoard(lambda lot_id: list(rows), ttl=0)
+    status = board.lot(1)
+    start = status.version
+
+    rows[4] = (1, 1, 4, 1)  # parked by another worker
+    time.sleep(0.01)
+    assert board.lot(1) is status
+    assert status.version.split('.')[0] == start.split('.')[0]
+    assert status.delta_since(start) == (4).to_bytes(4, 'little')
+
+    rows.append((1, 1, 10, 0))  # new slot: the layout and epoch change
+    time.sleep(0.01)
+    assert board.lot(1).delta_since(start) is None
+
 def test_get_users_with_token(client):
     """Test user listing endpoint with auth token"""
     token = get_auth_token()
@@ -281,6 +550,185 @@ def test_park_car_specific_slot(client):
     response_data = json.loads(response.data)
     assert response_data['assigned_slot']['slot_id'] == 1
 
+def add_slots(client, keys):
+    """Add (floor_id, row_id, slot_id) slots to the test lot, creating floors/rows as needed"""
+    with client.application.app_context():
+        for floor_id, row_id, slot_id in keys:
+            if not db.session.get(Floor, (1, floor_id)):
+                db.session.add(Floor(parkinglot_id=1, floor_id=floor_id, floor_name=f"Floor {floor_id}"))
+                db.session.flush()
+            if not db.session.get(Row, (1, floor_id, row_id)):
+                db.session.add(Row(parkinglot_id=1, floor_id=floor_id, row_id=row_id, row_name=f"R{row_id}"))
+                db.session.flush()
+            db.session.add(Slot(parkinglot_id=1, floor_id=floor_id, row_id=row_id, slot_id=slot_id,
+                                slot_name=f"{floor_id}-{row_id}-{slot_id}", status=0))
+        db.session.commit()
+
+def test_park_car_default_policy_fills_floor_first(client):
+    """Test the default policy keeps the original lowest-slot-first order"""
+    add_slots(client, [(1, 1, 2), (2, 1, 1)])
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    assigned = []
+    for reg_no in ["CAR1", "CAR2", "CAR3"]:
+        response = client.post('/park_car', json={
+            "parking_lot_name": "Test Parking",
+            "vehicle_reg_no": reg_no
+        }, headers=headers)
+        assert response.status_code == 201
+        slot = json.loads(response.data)['assigned_slot']
+        assigned.append((slot['floor_id'], slot['row_id'], slot['slot_id']))
+    assert assigned == [(1, 1, 1), (1, 1, 2), (2, 1, 1)]
+
+def test_park_car_spread_floors_policy(client):
+    """Test the spread_floors policy alternates between floors"""
+    add_slots(client, [(1, 1, 2), (2, 1, 1), (2, 1, 2)])
+    client.application.config['SLOT_ALLOCATION_POLICIES'] = {1: 'spread_floors'}
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    floors = []
+    for reg_no in ["CAR1", "CAR2", "CAR3"]:
+        response = client.post('/park_car', json={
+            "parking_lot_name": "Test Parking",
+            "vehicle_reg_no": reg_no
+        }, headers=headers)
+        assert response.status_code == 201
+        floors.append(json.loads(response.data)['assigned_slot']['floor_id'])
+    assert floors == [1, 2, 1]
+
+def test_park_car_two_wheeler_reserved_row(client):
+    """Test cars never take slots in rows reserved for two-wheelers"""
+    add_slots(client, [(1, 2, 1)])
+    client.application.config['SLOT_ALLOCATION_POLICIES'] = {1: 'two_wheeler_reserved'}
+    client.application.config['TWO_WHEELER_ROWS'] = {1: [(1, 1)]}
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    response = client.post('/park_car', json={
+        "parking_lot_name": "Test Parking",
+        "vehicle_reg_no": "CAR1"
+    }, headers=headers)
+    assert json.loads(response.data)['assigned_slot']['row_id'] == 2
+
+    response = client.post('/park_car', json={
+        "parking_lot_name": "Test Parking",
+        "vehicle_reg_no": "CAR2"
+    }, headers=headers)
+    assert response.status_code == 400
+
+    response = client.post('/park_car', json={
+        "parking_lot_name": "Test Parking",
+        "vehicle_reg_no": "BIKE1",
+        "vehicle_type": "two_wheeler"
+    }, headers=headers)
+    assert response.status_code == 201
+    assert json.loads(response.data)['assigned_slot']['row_id'] == 1
+
+def test_park_car_invalid_vehicle_type(client):
+    """Test validation of vehicle_type"""
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    response = client.post('/park_car', json={
+        "parking_lot_name": "Test Parking",
+        "vehicle_reg_no": "ABC123",
+        "vehicle_type": "truck"
+    }, headers=headers)
+    assert response.status_code == 400
+
+def test_spread_floors_ordering():
+    """Test spread_floors interleaves floors"""
+    layout = [(1, 1, 1), (1, 1, 2), (2, 1, 1), (2, 1, 2)]
+    assert spread_floors(layout) == [(1, 1, 1), (2, 1, 1), (1, 1, 2), (2, 1, 2)]
+
+def test_two_wheeler_reserved_ordering():
+    """Test reserved rows are excluded for cars and preferred for two-wheelers"""
+    layout = [(1, 1, 1), (1, 2, 1)]
+    assert two_wheeler_reserved(layout, reserved_rows=[(1, 2)]) == [(1, 1, 1)]
+    assert two_wheeler_reserved(layout, vehicle_type='two_wheeler', reserved_rows=[(1, 2)]) == [(1, 2, 1), (1, 1, 1)]
+
+def test_lot_allocator_release_reuses_best_slot():
+    """Test a released slot is handed out again before worse free slots"""
+    layout = [(1, 1, 1), (1, 1, 2), (1, 1, 3)]
+    allocator = LotAllocator(layout, layout)
+    assert allocator.pop() == (1, 1, 1)
+    assert allocator.pop() == (1, 1, 2)
+    allocator.release((1, 1, 1))
+    assert allocator.pop() == (1, 1, 1)
+    assert allocator.pop() == (1, 1, 3)
+    assert allocator.pop() is None
+
+def test_slot_allocator_reloads_outside_lock():
+    """Test old free lists are reloaded and changes made during a load are kept"""
+    layout = [(1, 1, 1), (1, 1, 2)]
+    loads = []
+
+    def free_loader(lot_id):
+        loads.append(lot_id)
+        if lot_id == 1 and len(loads) == 2:
+            # Another lot allocates, and this lot frees a slot, mid-load
+            assert allocator.pop(2) == (1, 1, 1)
+            allocator.release(1, (1, 1, 1))
+        return [(1, 1, 2)] if lot_id == 1 else layout
+
+    allocator = SlotAllocator(lambda lot_id: layout, free_loader, lambda lot_id: (DEFAULT_POLICY, {}), max_age=0)
+    assert allocator.pop(1) == (1, 1, 2)
+    time.sleep(0.01)
+    assert allocator.pop(1) == (1, 1, 1)
+    assert loads == [1, 1, 2]
+
+def test_slot_allocator_reuses_orderings():
+    """Test reloads only re-read the free list and a full lot is not reloaded on every park"""
+    layout = [(1, 1, 1), (1, 1, 2)]
+    free = []
+    layout_loads, free_loads, orderings = [], [], []
+
+    def layout_loader(lot_id):
+        layout_loads.append(lot_id)
+        return layout
+
+    def free_loader(lot_id):
+        free_loads.append(lot_id)
+        return list(free)
+
+    def options_for(lot_id):
+        orderings.append(lot_id)
+        return 'nearest_gate', {'gate_floor_id': None}
+
+    allocator = SlotAllocator(layout_loader, free_loader, options_for, max_age=30, min_reload=30)
+    assert allocator.pop(1) is None
+    for _ in range(5):
+        assert allocator.pop(1, reload=True) is None
+    assert (len(layout_loads), len(free_loads)) == (1, 1)
+
+    allocator.min_reload = 0
+    free.append((1, 1, 2))
+    assert allocator.pop(1, reload=True) == (1, 1, 2)
+    assert (len(layout_loads), len(free_loads)) == (1, 2)
+    assert len(allocator.orderings) == 1
+
+    layout.append((1, 1, 3))  # slot added without an invalidate
+    free.append((1, 1, 3))
+    assert allocator.pop(1, reload=True) == (1, 1, 2)
+    assert len(layout_loads) == 2
+
+def test_park_car_nearest_gate_policy(client):
+    """Test nearest_gate starts on the gate floor given in GATE_FLOORS"""
+    add_slots(client, [(1, 1, 2), (2, 1, 1), (2, 1, 2), (3, 1, 1)])
+    client.application.config['SLOT_ALLOCATION_POLICIES'] = {1: 'nearest_gate'}
+    client.application.config['GATE_FLOORS'] = {1: 2}
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    assigned = []
+    for reg_no in ["CAR1", "CAR2", "CAR3", "CAR4"]:
+        response = client.post('/park_car', json={
+            "parking_lot_name": "Test Parking",
+            "vehicle_reg_no": reg_no
+        }, headers=headers)
+        assert response.status_code == 201
+        slot = json.loads(response.data)['assigned_slot']
+        assigned.append((slot['floor_id'], slot['slot_id']))
+    # The gate floor first, then the nearest slots one ramp away in either direction
+    assert assigned == [(2, 1), (2, 2), (1, 1), (3, 1)]
+
 def test_remove_car_success(client):
     """Test complete parking cycle"""
     token = get_auth_token()
@@ -302,6 +750,49 @@ def test_remove_car_success(client):
         slot = Slot.query.filter_by(parkinglot_id=1, floor_id=1, row_id=1, slot_id=1).first()
         assert slot.status == 0
 
+def test_remove_car_closed_ticket(client):
+    """Test a closed ticket is not billed again and does not free a reused slot"""
+    set_charges(client, "Rs 20 per hour")
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    park_res = client.post('/park_car', json={
+        "parking_lot_name": "Test Parking",
+        "vehicle_reg_no": "ABC123"
+    }, headers=headers)
+    ticket_id = json.loads(park_res.data)['ticket_id']
+    assert client.delete('/remove_car_by_ticket', json={"ticket_id": ticket_id}, headers=headers).status_code == 200
+    client.post('/park_car', json={
+        "parking_lot_name": "Test Parking",
+        "vehicle_reg_no": "XYZ789"
+    }, headers=headers)
+
+    response = client.delete('/remove_car_by_ticket', json={"ticket_id": ticket_id}, headers=headers)
+    assert response.status_code == 404
+    with client.application.app_context():
+        assert db.session.get(Slot, (1, 1, 1, 1)).vehicle_reg_no == "XYZ789"
+        assert float(db.session.get(ParkingSession, ticket_id).fee) == 20.0
+
+def test_remove_car_keeps_slot_held_by_other_ticket(client):
+    """Test closing a session leaves its slot alone if another ticket holds it"""
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    park_res = client.post('/park_car', json={
+        "parking_lot_name": "Test Parking",
+        "vehicle_reg_no": "ABC123"
+    }, headers=headers)
+    ticket_id = json.loads(park_res.data)['ticket_id']
+    with client.application.app_context():
+        slot = db.session.get(Slot, (1, 1, 1, 1))
+        slot.vehicle_reg_no, slot.ticket_id = "XYZ789", "TKT-OTHER"
+        db.session.commit()
+
+    response = client.delete('/remove_car_by_ticket', json={"ticket_id": ticket_id}, headers=headers)
+    assert response.status_code == 200
+    with client.application.app_context():
+        slot = db.session.get(Slot, (1, 1, 1, 1))
+        assert (slot.status, slot.ticket_id) == (1, "TKT-OTHER")
+        assert db.session.get(ParkingSession, ticket_id).end_time is not None
+
 def test_remove_car_invalid_ticket(client):
     """Test invalid ticket handling"""
     token = get_auth_token()
@@ -309,6 +800,738 @@ def test_remove_car_invalid_ticket(client):
     response = client.delete('/remove_car_by_ticket', json={"ticket_id": "INVALID"}, headers=headers)
     assert response.status_code == 404
 
+# === Find My Car Tests ===
+
+def test_find_vehicle_by_plate(client):
+    """Test locating a parked car with a differently formatted plate"""
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    park_res = client.post('/park_car', json={
+        "parking_lot_name": "Test Parking",
+        "vehicle_reg_no": "DL-01 AB 1234"
+    }, headers=headers)
+    ticket_id = json.loads(park_res.data)['ticket_id']
+
+    response = client.get('/vehicles/dl01ab1234', headers=headers)
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['ticket_id'] == ticket_id
+    assert data['parking_name'] == "Test Parking"
+    assert (data['floor_id'], data['row_id'], data['slot_id']) == (1, 1, 1)
+
+def test_find_vehicle_not_parked(client):
+    """Test lookup of a plate with no open session"""
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    response = client.get('/vehicles/NOPE123', headers=headers)
+    assert response.status_code == 404
+
+def test_find_vehicle_after_removal(client):
+    """Test the lookup cache is invalidated when the car leaves"""
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    park_res = client.post('/park_car', json={
+        "parking_lot_name": "Test Parking",
+        "vehicle_reg_no": "ABC123"
+    }, headers=headers)
+    ticket_id = json.loads(park_res.data)['ticket_id']
+    assert client.get('/vehicles/ABC123', headers=headers).status_code == 200
+
+    client.delete('/remove_car_by_ticket', json={"ticket_id": ticket_id}, headers=headers)
+    assert client.get('/vehicles/ABC123', headers=headers).status_code == 404
+
+def test_plate_cache_skips_values_read_before_invalidation():
+    """Test a lookup racing with a park/unpark does not cache its stale read"""
+    cache = PlateCache(maxsize=2)
+    generation = cache.generation('ABC123')
+    cache.invalidate('ABC123')  # the car leaves while the lookup queries
+    cache.set('ABC123', {'ticket_id': 'TKT-1'}, generation)
+    assert cache.get('ABC123') is None
+
+    cache.set('ABC123', {'ticket_id': 'TKT-2'}, cache.generation('ABC123'))
+    assert cache.get('ABC123') == {'ticket_id': 'TKT-2'}
+
+    # Other plates' invalidations only matter once their generations are forgotten
+    generation = cache.generation('XYZ789')
+    cache.invalidate('DEF456')
+    cache.set('XYZ789', {'ticket_id': 'TKT-3'}, generation)
+    assert cache.get('XYZ789') == {'ticket_id': 'TKT-3'}
+    generation = cache.generation('XYZ789')
+    cache.invalidate('GHI000')  # evicts the oldest generation, ABC123's
+    cache.set('XYZ789', {'ticket_id': 'TKT-4'}, generation)
+    assert cache.get('XYZ789') == {'ticket_id': 'TKT-3'}
+
+def test_remove_car_by_plate(client):
+    """Test removing a car by its registration number"""
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    park_res = client.post('/park_car', json={
+        "parking_lot_name": "Test Parking",
+        "vehicle_reg_no": "ABC 123"
+    }, headers=headers)
+    ticket_id = json.loads(park_res.data)['ticket_id']
+
+    response = client.delete('/remove_car_by_ticket', json={"vehicle_reg_no": "abc-123"}, headers=headers)
+    assert response.status_code == 200
+    assert json.loads(response.data)['ticket_id'] == ticket_id
+
+    with client.application.app_context():
+        slot = Slot.query.filter_by(parkinglot_id=1, floor_id=1, row_id=1, slot_id=1).first()
+        assert slot.status == 0
+
+def test_remove_car_missing_ticket_and_plate(client):
+    """Test remove requires a ticket or a plate"""
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    response = client.delete('/remove_car_by_ticket', json={}, headers=headers)
+    assert response.status_code == 400
+
+# === Billing Tests ===
+
+def set_charges(client, car_charge, two_wheeler_charge=None):
+    with client.application.app_context():
+        lot = db.session.get(ParkingLotDetails, 1)
+        lot.car_parking_charge = car_charge
+        lot.two_wheeler_parking_charge = two_wheeler_charge
+        db.session.commit()
+
+def test_remove_car_charges_fee(client):
+    """Test the session is billed from the lot tariff at exit"""
+    set_charges(client, "Rs 20 per hour")
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    park_res = client.post('/park_car', json={
+        "parking_lot_name": "Test Parking",
+        "vehicle_reg_no": "ABC123"
+    }, headers=headers)
+    ticket_id = json.loads(park_res.data)['ticket_id']
+
+    # Backdate the start so the stay is 3.5 hours
+    with client.application.app_context():
+        session = db.session.get(ParkingSession, ticket_id)
+        session.start_time = datetime.utcnow() - timedelta(hours=3, minutes=30)
+        db.session.commit()
+
+    response = client.delete('/remove_car_by_ticket', json={"ticket_id": ticket_id}, headers=headers)
+    assert response.status_code == 200
+    assert json.loads(response.data)['fee'] == 80.0
+
+    with client.application.app_context():
+        assert float(db.session.get(ParkingSession, ticket_id).fee) == 80.0
+
+def test_parking_lot_invoice(client):
+    """Test the invoice totals closed sessions per vehicle type"""
+    set_charges(client, "20 per hour max 100", "Rs 10 per parking")
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    for reg_no, vehicle_type in [("CAR1", "car"), ("BIKE1", "two_wheeler")]:
+        park_res = client.post('/park_car', json={
+            "parking_lot_name": "Test Parking",
+            "vehicle_reg_no": reg_no,
+            "vehicle_type": vehicle_type
+        }, headers=headers)
+        ticket_id = json.loads(park_res.data)['ticket_id']
+        client.delete('/remove_car_by_ticket', json={"ticket_id": ticket_id}, headers=headers)
+
+    response = client.get('/parkinglots/1/invoice', headers=headers)
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['sessions'] == 2
+    assert data['unbilled_sessions'] == 0
+    assert data['total_fee'] == 30.0
+    assert data['by_vehicle_type']['two_wheeler']['total_fee'] == 10.0
+
+    # Invoices re-price at the current tariff; the fees charged at exit stay
+    set_charges(client, "Rs 30 per parking", "Rs 10 per parking")
+    data = json.loads(client.get('/parkinglots/1/invoice', headers=headers).data)
+    assert data['by_vehicle_type']['car'] == {'sessions': 1, 'total_fee': 30.0}
+    with client.application.app_context():
+        fees = db.session.execute(select(ParkingSession.fee).order_by(ParkingSession.vehicle_type)).scalars().all()
+    assert [float(fee) for fee in fees] == [20.0, 10.0]
+
+def test_parking_lot_invoice_unknown_lot(client):
+    """Test the invoice for a missing lot"""
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    response = client.get('/parkinglots/999/invoice', headers=headers)
+    assert response.status_code == 404
+
+def test_parse_tariff_patterns():
+    """Test the charge strings found in the parking data"""
+    assert parse_tariff("Free parking.").fee(5) == 0.0
+    assert parse_tariff("Not applicable.").fee(5) is None
+    assert parse_tariff("Rs 10 per Parking").fee(30) == 10.0
+    assert parse_tariff("Rs 20 per hour").fee(2.5) == 60.0
+    assert parse_tariff("20 per hour max 100").fee(10) == 100.0
+    assert parse_tariff("20 per hour max 100").fee(30) == 200.0
+    assert parse_tariff("20 rs for first hour 10 for the next subsequent hours").fee(3) == 40.0
+    assert parse_tariff("20 up to 6 hours 30 for 12 hours").fee(7) == 30.0
+    assert parse_tariff("20rs for first 6 hours 30 rs beyond that.").fee(8) == 30.0
+    with pytest.raises(ValueError):
+        parse_tariff("Ask the attendant")
+
+def test_bill_sessions_matches_scalar_fee():
+    """Test vectorized billing agrees with per-session pricing"""
+    tariffs = [parse_tariff("Rs 20 per hour"), parse_tariff("10 up to 6 hours 15 up to 12"),
+               parse_tariff("No Cars")]
+    hours = [0.0, 1.0, 1.1, 6.0, 12.5, 24.0, 49.9, 3.0]
+    tariff_ids = [0, 1, 2, 1, 1, 0, 1, 2]
+    fees = bill_sessions(hours, tariff_ids, tariffs)
+    for fee, h, t in zip(fees, hours, tariff_ids):
+        expected = tariffs[t].fee(h)
+        if expected is None:
+            assert fee != fee  # NaN
+        else:
+            assert fee == expected
+
+# === Forecast Tests ===
+
+def add_history(client, first_start, weeks, per_week, stay_hours):
+    """Add closed sessions starting at the same hour of week for several past weeks"""
+    with client.application.app_context():
+        for week in range(1, weeks + 1):
+            for n in range(per_week):
+                start = first_start - timedelta(weeks=week) + timedelta(minutes=n)
+                db.session.add(ParkingSession(
+                    ticket_id=f"HIST-{week}-{n}", parkinglot_id=1, floor_id=1, row_id=1, slot_id=1,
+                    vehicle_reg_no=f"OLD{week}{n}", user_id=1,
+                    start_time=start, end_time=start + timedelta(hours=stay_hours)
+                ))
+        db.session.commit()
+
+def test_parking_lot_forecast(client):
+    """Test the forecast projects arrivals from the same hour in past weeks"""
+    next_hour = datetime.utcnow().replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    add_history(client, next_hour, weeks=2, per_week=4, stay_hours=3)
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    response = client.get('/parkinglots/1/forecast?hours=6', headers=headers)
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['capacity'] == 1
+    assert data['occupied'] == 0
+    assert len(data['hours']) == 6
+    assert data['hours'][0]['hour'] == next_hour.isoformat()
+    assert data['hours'][0]['expected_arrivals'] > 3
+    assert data['hours'][0]['expected_occupied'] == 1
+    assert data['full_at'] == next_hour.isoformat()
+    assert data['hours'][3]['expected_departures'] > 3
+
+def test_parking_lot_forecast_updates_incrementally(client):
+    """Test closing a session updates the built profile without a rebuild"""
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    client.get('/parkinglots/1/forecast', headers=headers)
+    model = client.application.extensions['forecast_model']
+    assert model.profiles[1].arrivals.sum() == 0
+
+    park_res = client.post('/park_car', json={
+        "parking_lot_name": "Test Parking",
+        "vehicle_reg_no": "ABC123"
+    }, headers=headers)
+    ticket_id = json.loads(park_res.data)['ticket_id']
+    client.delete('/remove_car_by_ticket', json={"ticket_id": ticket_id}, headers=headers)
+    assert model.profiles[1].arrivals.sum() == 1
+    assert model.profiles[1].departures.sum() == 1
+
+def test_parking_lot_forecast_rebuilds_from_sql_counts(client):
+    """Test old profiles are rebuilt from hour-of-week counts grouped in the database"""
+    client.application.config['FORECAST_UTC_OFFSET_HOURS'] = 5.5
+    start = datetime(2026, 10, 19, 20, 45)  # Monday 20:45 UTC, Tuesday 02:15 at +5:30
+    add_history(client, start + timedelta(weeks=1), weeks=1, per_week=2, stay_hours=3)
+    model = client.application.extensions['forecast_model']
+    with client.application.app_context():
+        arrivals, departures, first_seen, last_seen = model.loader(1, timedelta(hours=5.5))
+    assert arrivals == {26: 2}
+    assert departures == {29: 2}
+    assert (first_seen, last_seen) == (start, start + timedelta(hours=3, minutes=1))
+
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    client.get('/parkinglots/1/forecast', headers=headers)
+    assert model.profiles[1].arrivals.sum() == 2
+    # Closed by another worker: only a rebuild sees it
+    with client.application.app_context():
+        db.session.add(ParkingSession(
+            ticket_id="OTHER-WORKER", parkinglot_id=1, floor_id=1, row_id=1, slot_id=1,
+            vehicle_reg_no="OTHER1", user_id=1, start_time=start + timedelta(weeks=1),
+            end_time=start + timedelta(weeks=1, hours=1)
+        ))
+        db.session.commit()
+    client.get('/parkinglots/1/forecast', headers=headers)
+    assert model.profiles[1].arrivals.sum() == 2
+    model.max_age = 0
+    client.get('/parkinglots/1/forecast', headers=headers)
+    assert model.profiles[1].arrivals.sum() == 2 + 1
+
+def test_parking_lot_forecast_validation(client):
+    """Test forecast errors for unknown lots and bad horizons"""
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    assert client.get('/parkinglots/999/forecast', headers=headers).status_code == 404
+    assert client.get('/parkinglots/1/forecast?hours=0', headers=headers).status_code == 400
+
+def test_hour_of_week():
+    """Test hour-of-week buckets start on Monday"""
+    assert hour_of_week(datetime(2026, 10, 19, 0, 30)) == 0  # Monday
+    assert hour_of_week(datetime(2026, 10, 25, 23, 0)) == 167  # Sunday
+
+# === Synthetic Data Tests ===
+
+def test_synthetic_data_is_deterministic():
+    """Test the same seed gives the same sessions"""
+    args = (7, 3, 200, 2, 5, 10, list(range(1, 11)), datetime(2026, 1, 1), 30)
+    first = synthetic_data.session_arrays(*args)
+    second = synthetic_data.session_arrays(*args)
+    for column in first:
+        assert (first[column] == second[column]).all()
+    assert (first['floor_id'] <= 2).all() and (first['slot_id'] <= 10).all()
+
+def test_synthetic_sessions_never_share_a_slot():
+    """Test generated stays in the same slot do not overlap in time"""
+    arrays = synthetic_data.session_arrays(7, 3, 2000, 1, 2, 5, list(range(1, 11)), datetime(2026, 1, 1), 30)
+    slot_index = (arrays['row_id'] - 1) * 5 + arrays['slot_id'] - 1
+    assert len(np.unique(slot_index)) == 10
+    for slot in range(10):
+        mask = slot_index == slot
+        order = np.argsort(arrays['start_time'][mask])
+        starts, ends = arrays['start_time'][mask][order], arrays['end_time'][mask][order]
+        assert (starts[1:] >= ends[:-1]).all()
+
+def test_synthetic_data_load(client):
+    """Test a small generated dataset loads and is served by the API"""
+    with client.application.app_context():
+        counts = synthetic_data.generate(
+            db.engine, lots=2, floors=2, rows=2, slots=3, users=5, sessions_per_lot=50,
+            start_lot_id=100, start_user_id=100
+        )
+    assert counts == {'lots': 2, 'floors': 4, 'rows': 8, 'slots': 24, 'users': 5, 'sessions': 100}
+
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    data = json.loads(client.get('/parkinglots/101/invoice', headers=headers).data)
+    assert data['sessions'] == 50
+    data = json.loads(client.get('/parking_lot_structure?parkinglot_id=100', headers=headers).data)
+    assert len(data) == 2 and len(data[0]['rows'][0]['slots']) == 3
+
+# === Write-Ahead Event Log Tests ===
+
+def test_logged_park_and_remove(logged_client):
+    """Test gates acknowledged from the event log reach the database"""
+    set_charges(logged_client, "Rs 20 per hour")
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    response = logged_client.post('/park_car', json={
+        "parking_lot_name": "Test Parking",
+        "vehicle_reg_no": "ABC123"
+    }, headers=headers)
+    assert response.status_code == 201
+    ticket_id = json.loads(response.data)['ticket_id']
+
+    # Removal does not wait for the park to be applied
+    response = logged_client.delete('/remove_car_by_ticket', json={"vehicle_reg_no": "ABC 123"}, headers=headers)
+    assert response.status_code == 200
+    assert json.loads(response.data)['fee'] == 20.0
+    response = logged_client.delete('/remove_car_by_ticket', json={"ticket_id": ticket_id}, headers=headers)
+    assert response.status_code == 404
+
+    writer = logged_client.application.extensions['event_writer']
+    writer.sync(timeout=5)
+    with logged_client.application.app_context():
+        session = db.session.get(ParkingSession, ticket_id)
+        assert session.end_time is not None
+        assert float(session.fee) == 20.0
+        assert db.session.get(Slot, (1, 1, 1, 1)).status == 0
+
+    # Replaying the whole log after a crash changes nothing
+    writer.apply_batch(list(writer.log.replay()))
+    with logged_client.application.app_context():
+        assert ParkingSession.query.count() == 1
+        assert db.session.get(Slot, (1, 1, 1, 1)).ticket_id is None
+
+def test_logged_park_reserves_slot_before_apply(logged_client):
+    """Test a slot taken through the log is not handed out again"""
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    logged_client.post('/park_car', json={
+        "parking_lot_name": "Test Parking",
+        "vehicle_reg_no": "ABC123"
+    }, headers=headers)
+    response = logged_client.post('/park_car', json={
+        "parking_lot_name": "Test Parking",
+        "vehicle_reg_no": "XYZ789",
+        "floor_id": 1, "row_id": 1, "slot_id": 1
+    }, headers=headers)
+    assert response.status_code == 400
+
+def test_event_log_recovery(tmp_path):
+    """Test a torn tail is cut off and unapplied events are replayed"""
+    log = EventLog(str(tmp_path), segment_bytes=100).open()
+    for i in range(5):
+        log.wait_durable(log.append({'type': 'park', 'n': i}))
+    log.close()
+    assert len(log.segments()) > 1
+    with open(log.segment_path(log.segments()[-1]), 'ab') as f:
+        f.write(b'0000abcd {"type":"pa')
+
+    applied = []
+    log = EventLog(str(tmp_path), segment_bytes=100)
+    writer = EventWriter(log, applied.append, batch_size=2)
+    writer.write_checkpoint(2)
+    writer.applied_seq = writer.read_checkpoint()
+    writer.start()
+    assert [[e['n'] for e in batch] for batch in applied] == [[2, 3], [4]]
+    assert log.next_seq == 6
+
+    log.wait_durable(log.append({'type': 'park', 'n': 5}))
+    writer.sync(timeout=5)
+    writer.stop()
+    assert applied[-1] == [{'type': 'park', 'n': 5, 'seq': 6}]
+    assert writer.read_checkpoint() == 6
+    assert min(log.segments()) > 1
+
+def test_event_log_starts_on_first_gate_request(logged_client, tmp_path):
+    """Test building the app leaves the log alone and the directory is locked once in use"""
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    logged_client.get('/parking_lot_structure', headers=headers)
+    assert not (tmp_path / 'events').exists()
+
+    response = logged_client.post('/park_car', json={
+        "parking_lot_name": "Test Parking",
+        "vehicle_reg_no": "ABC123"
+    }, headers=headers)
+    assert response.status_code == 201
+    assert logged_client.application.extensions['event_writer'].thread.is_alive()
+    with pytest.raises(EventLogLocked):
+        EventLog(str(tmp_path / 'events')).open()
+
+def test_corrupt_event_log_releases_lock_and_fails_gates(logged_client, tmp_path):
+    """Test a log that cannot be recovered is reported by gates and stays unlocked"""
+    log = EventLog(str(tmp_path / 'events'), segment_bytes=100).open()
+    for i in range(3):
+        log.wait_durable(log.append({'type': 'park', 'n': i}))
+    log.close()
+    with open(log.segment_path(log.segments()[0]), 'r+b') as f:
+        f.write(b'garbage')
+    failed = EventLog(str(tmp_path / 'events'))
+    with pytest.raises(EventLogCorrupt):
+        failed.open()
+    with pytest.raises(EventLogCorrupt):  # not EventLogLocked: the failed open let go
+        EventLog(str(tmp_path / 'events')).open()
+
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    for _ in range(2):
+        response = logged_client.post('/park_car', json={
+            "parking_lot_name": "Test Parking",
+            "vehicle_reg_no": "ABC123"
+        }, headers=headers)
+        assert response.status_code == 503
+        assert 'bad record' in json.loads(response.data)['error']
+
+def test_logged_park_rejects_event_the_database_would_not_take(logged_client):
+    """Test events are validated before they are logged and acknowledged"""
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    response = logged_client.post('/park_car', json={
+        "parking_lot_name": "Test Parking",
+        "vehicle_reg_no": "X" * 21
+    }, headers=headers)
+    assert response.status_code == 400
+    response = logged_client.post('/park_car', json={
+        "parking_lot_name": "Test Parking",
+        "vehicle_reg_no": "ABC123"
+    }, headers={'Authorization': f'Bearer {get_auth_token(user_id=99)}'})
+    assert response.status_code == 404
+    assert logged_client.application.extensions['event_writer'].log.next_seq == 1
+
+def test_logged_gate_fails_fast_when_log_cannot_write(logged_client):
+    """Test a failed log write fails the waiting gate and later ones with a 503"""
+    add_slots(logged_client, [(1, 1, 2)])
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    writer = logged_client.application.extensions['event_writer']
+    writer.ensure_started()
+    log = writer.log
+    log.file.close()  # the flusher's next write raises
+    for reg_no in ("ABC123", "XYZ789"):
+        response = logged_client.post('/park_car', json={
+            "parking_lot_name": "Test Parking",
+            "vehicle_reg_no": reg_no
+        }, headers=headers)
+        assert response.status_code == 503
+    assert isinstance(log.failed, ValueError)
+
+def test_event_writer_dead_letters_failing_event(tmp_path):
+    """Test a failing batch is split up and only the bad event is set aside"""
+    applied = []
+    outages = [ConnectionError('database down')]
+    def apply_batch(batch):
+        if outages:
+            raise outages.pop()
+        if any(e.get('bad') for e in batch):
+            raise ValueError('value too long')
+        applied.extend(e['n'] for e in batch)
+
+    log = EventLog(str(tmp_path))
+    writer = EventWriter(log, apply_batch, retry_interval=0)
+    writer.start()
+    for n in range(3):
+        writer.submit({'type': 'park', 'ticket_id': f'T{n}', 'parkinglot_id': 1, 'floor_id': 1,
+                       'row_id': 1, 'slot_id': n, 'n': n, 'bad': n == 1}, f'CAR{n}')
+    writer.sync(timeout=5)
+    writer.stop()
+
+    assert sorted(applied) == [0, 2]
+    assert writer.read_checkpoint() == 3
+    with open(writer.dead_letter_path, 'rb') as f:
+        dead = [decode(line) for line in f]
+    assert [(e['seq'], e['n']) for e in dead] == [(2, 1)]
+    assert 'value too long' in dead[0]['error']
+
+def test_pending_events_overlay():
+    """Test pending entries give way once their own event is applied"""
+    pending = PendingEvents()
+    park = {'type': 'park', 'ticket_id': 'T1', 'parkinglot_id': 1, 'floor_id': 1, 'row_id': 1, 'slot_id': 1}
+    pending.add(1, park, 'ABC123')
+    pending.add(2, dict(park, type='unpark'), 'ABC123')
+    assert pending.slot(1, (1, 1, 1)) == (True, None)
+    assert pending.ticket('T1') == (park, True)
+    assert pending.plate('ABC123') == (True, None)
+
+    pending.applied(1)
+    assert pending.slot(1, (1, 1, 1)) == (True, None)
+    pending.applied(2)
+    assert pending.slot(1, (1, 1, 1)) == (False, None)
+    assert pending.ticket('T1') is None
+    pending.add(2, park, 'ABC123')  # applied before it was registered
+    assert pending.plate('ABC123') == (False, None)
+
+# === Lot Sharding Tests ===
+
+def shard_rows(client, bind_key, statement):
+    with client.application.app_context():
+        with db.engines[bind_key].connect() as conn:
+            return conn.execute(statement).all()
+
+def test_sharded_park_and_remove(sharded_client):
+    """Test gate traffic for a lot only touches that lot's database"""
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    response = sharded_client.post('/park_car', json={
+        "parking_lot_name": "Lot 100",
+        "vehicle_reg_no": "ABC123"
+    }, headers=headers)
+    assert response.status_code == 201
+    ticket_id = json.loads(response.data)['ticket_id']
+    assert ticket_id.startswith("TKT-100-")
+
+    assert shard_rows(sharded_client, 'shard_b', select(Slot.status)) == [(1,)]
+    assert shard_rows(sharded_client, 'shard_b', select(ParkingSession.ticket_id)) == [(ticket_id,)]
+    assert shard_rows(sharded_client, None, select(ParkingSession.ticket_id)) == []
+    assert shard_rows(sharded_client, 'shard_c', select(Slot.status)) == [(0,)]
+
+    data = json.loads(sharded_client.get('/vehicles/ABC123', headers=headers).data)
+    assert data['parkinglot_id'] == 100 and data['parking_name'] == "Lot 100"
+
+    response = sharded_client.delete('/remove_car_by_ticket', json={"vehicle_reg_no": "ABC123"}, headers=headers)
+    assert response.status_code == 200
+    assert shard_rows(sharded_client, 'shard_b', select(Slot.status)) == [(0,)]
+    end_times = shard_rows(sharded_client, 'shard_b', select(ParkingSession.end_time))
+    assert end_times[0][0] is not None
+
+def test_sharded_listings_and_history(sharded_client):
+    """Test cross-lot listings and user history gather every shard"""
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    data = json.loads(sharded_client.get('/parkinglots_details', headers=headers).data)
+    assert [lot['parkinglot_id'] for lot in data] == [1, 100, 200]
+    data = json.loads(sharded_client.get('/parking_lot_structure', headers=headers).data)
+    assert len(data) == 3
+
+    for lot_name, reg_no in [("Test Parking", "CAR1"), ("Lot 200", "CAR2"), ("Lot 100", "CAR3")]:
+        response = sharded_client.post('/park_car', json={
+            "parking_lot_name": lot_name,
+            "vehicle_reg_no": reg_no
+        }, headers=headers)
+        assert response.status_code == 201
+        time.sleep(0.01)
+
+    data = json.loads(sharded_client.get('/users/1/sessions', headers=headers).data)
+    assert [s['vehicle_reg_no'] for s in data] == ["CAR3", "CAR2", "CAR1"]
+    data = json.loads(sharded_client.get('/users/1/sessions?limit=2', headers=headers).data)
+    assert [s['parkinglot_id'] for s in data] == [100, 200]
+    assert sharded_client.get('/users/2/sessions', headers=headers).status_code == 403
+
+def test_sharded_query_budget_counts_scatter_per_shard(sharded_client):
+    """Test only the lot lookup of a gate request is budgeted per shard"""
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    budget = sharded_client.application.view_functions['park_car'].query_budget
+    assert budget['scatter'] == 1 and not budget['per_shard']
+    response = sharded_client.post('/park_car', json={
+        "parking_lot_name": "Lot 200",
+        "vehicle_reg_no": "ABC123"
+    }, headers=headers)
+    assert response.status_code == 201
+    assert int(response.headers['X-Query-Count']) <= budget['statements'] + 3
+
+    sharded_client.application.config['QUERY_BUDGETS'] = {'park_car': {'statements': budget['statements']}}
+    with pytest.raises(QueryBudgetExceeded):
+        sharded_client.post('/park_car', json={
+            "parking_lot_name": "Lot 100",
+            "vehicle_reg_no": "XYZ789"
+        }, headers=headers)
+
+def test_sharded_synthetic_data_load(sharded_client):
+    """Test generated lots are loaded into the database of their shard"""
+    app = sharded_client.application
+    router = app.extensions['lot_router']
+    with app.app_context():
+        counts = synthetic_data.generate(
+            db.engine, lots=2, floors=1, rows=1, slots=2, users=3, sessions_per_lot=10,
+            start_lot_id=150, start_user_id=100,
+            lot_engine=lambda lot_id: db.engines[router.shard_for(lot_id)]
+        )
+    assert counts == {'lots': 2, 'floors': 2, 'rows': 2, 'slots': 4, 'users': 3, 'sessions': 20}
+    assert shard_rows(sharded_client, 'shard_b', select(func.count()).select_from(Slot)) == [(5,)]
+    assert shard_rows(sharded_client, 'shard_b', select(func.count()).select_from(ParkingSession)) == [(20,)]
+    assert shard_rows(sharded_client, None, select(func.count()).select_from(ParkingSession)) == [(0,)]
+    assert shard_rows(sharded_client, None, select(func.count()).select_from(User)) == [(4,)]
+
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    data = json.loads(sharded_client.get('/parkinglots/151/invoice', headers=headers).data)
+    assert data['sessions'] == 10
+
+def test_lot_router_ranges():
+    """Test lot ids map to the shard of the range they fall in"""
+    router = LotRouter([(1000, 'lots_b'), (1, None), (5000, 'lots_c')])
+    assert [router.shard_for(lot_id) for lot_id in (1, 999, 1000, 4999, 5000, 90000)] == [
+        None, None, 'lots_b', 'lots_b', 'lots_c', 'lots_c'
+    ]
+    assert router.shards() == [None, 'lots_b', 'lots_c']
+    assert LotRouter().shards() == [None]
+
+# === Stale Session Sweep Tests ===
+
+def park_and_backdate(client, headers, reg_no, hours_ago):
+    park_res = client.post('/park_car', json={
+        "parking_lot_name": "Test Parking",
+        "vehicle_reg_no": reg_no
+    }, headers=headers)
+    ticket_id = json.loads(park_res.data)['ticket_id']
+    with client.application.app_context():
+        session = db.session.get(ParkingSession, ticket_id)
+        session.start_time = datetime.utcnow() - timedelta(hours=hours_ago)
+        db.session.commit()
+    return ticket_id
+
+def test_sweep_stale_sessions(client):
+    """Test stale open sessions are closed and their slots freed in chunks"""
+    add_slots(client, [(1, 1, 2), (1, 1, 3)])
+    client.application.config['ADMIN_USER_IDS'] = [1]
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    stale = [park_and_backdate(client, headers, f"OLD{n}", 30) for n in range(2)]
+    fresh = park_and_backdate(client, headers, "NEW1", 1)
+
+    response = client.post('/admin/sweep_stale_sessions', json={"chunk_size": 1}, headers=headers)
+    assert response.status_code == 200
+    report = json.loads(response.data)
+    assert report['closed_sessions'] == 2
+    assert report['freed_slots'] == 2
+    assert report['lots']['1'] == {'closed_sessions': 2, 'freed_slots': 2}
+
+    with client.application.app_context():
+        for ticket_id in stale:
+            session = db.session.get(ParkingSession, ticket_id)
+            assert session.end_time is not None
+            assert session.fee is None
+        assert db.session.get(ParkingSession, fresh).end_time is None
+        assert Slot.query.filter_by(parkinglot_id=1, status=1).count() == 1
+
+    assert client.get('/vehicles/OLD0', headers=headers).status_code == 404
+    structure = json.loads(client.get('/parking_lot_structure?parkinglot_id=1', headers=headers).data)
+    assert [s['status'] for s in structure[0]['rows'][0]['slots']] == [0, 0, 1]
+
+def test_swept_sessions_not_billed_or_forecast(client):
+    """Test sessions closed by the sweep stay out of invoices and the forecast history"""
+    client.application.config['ADMIN_USER_IDS'] = [1]
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    set_charges(client, "Rs 20 per hour")
+    add_history(client, datetime.utcnow(), weeks=1, per_week=1, stay_hours=2)
+    ticket_id = park_and_backdate(client, headers, "OLD1", 30)
+    client.post('/admin/sweep_stale_sessions', json={}, headers=headers)
+
+    with client.application.app_context():
+        assert db.session.get(ParkingSession, ticket_id).swept is True
+        assert db.session.get(ParkingSession, "HIST-1-0").swept is False
+        arrivals, departures, _, _ = client.application.extensions['forecast_model'].loader(1, timedelta(0))
+    assert sum(arrivals.values()) == sum(departures.values()) == 1
+
+    invoice = json.loads(client.get('/parkinglots/1/invoice', headers=headers).data)
+    assert invoice['sessions'] == 1
+    assert invoice['total_fee'] == 40.0
+
+def test_sweep_keeps_reused_slot(client):
+    """Test a stale session is closed without freeing a slot now held by another car"""
+    client.application.config['ADMIN_USER_IDS'] = [1]
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    client.post('/park_car', json={"parking_lot_name": "Test Parking", "vehicle_reg_no": "NEW1"}, headers=headers)
+    add_history(client, datetime.utcnow(), weeks=1, per_week=1, stay_hours=1)
+    with client.application.app_context():
+        db.session.get(ParkingSession, "HIST-1-0").end_time = None
+        db.session.commit()
+
+    report = json.loads(client.post('/admin/sweep_stale_sessions', json={}, headers=headers).data)
+    assert report['closed_sessions'] == 1
+    assert report['freed_slots'] == 0
+    with client.application.app_context():
+        assert db.session.get(Slot, (1, 1, 1, 1)).vehicle_reg_no == "NEW1"
+
+def test_sweep_stale_sessions_dry_run_and_cli(client):
+    """Test dry runs only count, from the endpoint and the CLI"""
+    client.application.config['ADMIN_USER_IDS'] = [1]
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    park_and_backdate(client, headers, "OLD1", 30)
+
+    report = json.loads(client.post('/admin/sweep_stale_sessions', json={"dry_run": True}, headers=headers).data)
+    assert report['closed_sessions'] == 1
+    result = client.application.test_cli_runner().invoke(args=['sweep-stale-sessions', '--dry-run'])
+    assert "total: closed 1" in result.output
+
+    result = client.application.test_cli_runner().invoke(args=['sweep-stale-sessions', '--max-age-hours', '48'])
+    assert "total: closed 0" in result.output
+
+def test_sweep_stale_sessions_validates_body(client):
+    """Test bad sweep parameters are rejected instead of falling back to defaults"""
+    client.application.config['ADMIN_USER_IDS'] = [1]
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    park_and_backdate(client, headers, "OLD1", 30)
+    for body in [{"max_age_hours": 0}, {"max_age_hours": "24"}, {"chunk_size": -1},
+                 {"chunk_size": 1.5}, {"parkinglot_id": "1"}, {"parkinglot_id": True}]:
+        response = client.post('/admin/sweep_stale_sessions', json={**body, "dry_run": True}, headers=headers)
+        assert response.status_code == 400, body
+        assert next(iter(body)) in json.loads(response.data)['error']
+
+    # An explicit age overrides the configured one; fractional hours are fine
+    client.application.config['STALE_SESSION_HOURS_BY_LOT'] = {1: 100}
+    report = json.loads(client.post('/admin/sweep_stale_sessions', json={"max_age_hours": 0.5}, headers=headers).data)
+    assert report['closed_sessions'] == 1
+
+def test_sweep_stale_sessions_requires_admin(client):
+    """Test non-admin users cannot run the sweep"""
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    response = client.post('/admin/sweep_stale_sessions', json={}, headers=headers)
+    assert response.status_code == 403
+
 # === User Management Tests ===
 
 def test_update_user_success(client):
@@ -366,4 +1589,53 @@ def test_update_user_duplicate_email(client):
     response = client.put('/users/1', json={"user_email": "second@example.com"}, headers=headers)
     assert response.status_code == 400
     response_data = json.loads(response.data)
-    assert "already in use" in response_data['error']
\ No newline at end of file
+    assert "already in use" in response_data['error']
+
+# === Query Budget Tests ===
+
+def test_all_routes_declare_query_budget(client):
+    """Test every route declares a SQL budget"""
+    app = client.application
+    for rule in app.url_map.iter_rules():
+        if rule.endpoint == 'static':
+            continue
+        assert hasattr(app.view_functions[rule.endpoint], 'query_budget'), rule.rule
+
+def test_route_query_budgets(client):
+    """Test each route stays within its declared statement budget"""
+    token = get_auth_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    calls = [
+        ('get', '/', None, 0),
+        ('post', '/register', {"user_name": "Budget", "user_email": "budget@example.com",
+                               "user_password": "pass", "user_phone_no": "3333333333"}, 3),
+        ('post', '/login', {"user_email": "test@example.com", "user_password": "password"}, 1),
+        ('get', '/parkinglots_details', None, 1),
+        ('get', '/parking_lot_structure', None, 4),
+        ('get', '/parking_lot_structure?parkinglot_id=1', None, 3),
+        ('get', '/parking_lot_structure/cache_stats', None, 0),
+        ('get', '/users', None, 1),
+        ('post', '/park_car', {"parking_lot_name": "Test Parking", "vehicle_reg_no": "ABC123"}, 6),
+        ('get', '/vehicles/ABC123', None, 2),
+        ('get', '/vehicles/ABC123', None, 0),  # cached
+        ('delete', '/remove_car_by_ticket', {"vehicle_reg_no": "ABC123"}, 7),
+        ('get', '/parkinglots/1/invoice', None, 2),
+        ('get', '/parkinglots/1/forecast', None, 2),
+        ('get', '/parkinglots/1/layout', None, 3),
+        ('get', '/parkinglots/1/status', None, 1),
+        ('get', '/users/1/sessions', None, 1),
+        ('put', '/users/1', {"user_name": "Budget Name"}, 3),
+    ]
+    for method, path, body, budget in calls:
+        response = getattr(client, method)(path, json=body, headers=headers)
+        assert response.status_code < 400, path
+        assert int(response.headers['X-Query-Count']) <= budget, path
+
+def test_query_budget_exceeded_fails_in_testing(client):
+    """Test going over budget raises in TESTING mode"""
+    client.application.config['QUERY_BUDGETS'] = {'login': {'statements': 0}}
+    with pytest.raises(QueryBudgetExceeded):
+        client.post('/login', json={
+            "user_email": "test@example.com",
+            "user_password": "password"
+        })